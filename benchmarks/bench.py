@@ -0,0 +1,178 @@
+# Throughput benchmarks over a directory of prefetch files, such as a corpus
+# written by synthetic.py.
+#
+# Each phase runs in a freshly spawned process so its peak RSS is its own:
+#
+#   decompress  read every MAM file and decompress it, nothing else
+#   parse       construct a Prefetch object for every file
+#   lazy        construct a LazyPrefetch object for every file
+#   cli         run prefetch.py over the directory, output to /dev/null
+#
+# Usage: python benchmarks/bench.py CORPUS [--phases parse,cli] [--json]
+#
+# Extra prefetch.py arguments for the cli phase go after --, for example
+# "-- --csv --jobs 4". Peak RSS of the cli phase does not include worker
+# processes started with --jobs.
+
+
+import os
+import sys
+import json
+import time
+import struct
+import resource
+import multiprocessing
+from argparse import ArgumentParser
+
+# Benchmark the working tree rather than an installed copy
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+PHASES = ("decompress", "parse", "lazy", "cli")
+
+
+def peakRss():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def listFiles(corpus):
+    paths = []
+    for root, dirs, files in os.walk(corpus):
+        dirs.sort()
+        for name in sorted(files):
+            paths.append(os.path.join(root, name))
+    return paths
+
+
+def runDecompress(paths, cliArgs):
+    from windowsprefetch.utils import DecompressWin10, MAM_MAGIC
+    decompressor = DecompressWin10()
+    files = nbytes = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < 8 or struct.unpack_from("<L", data)[0] & 0x00FFFFFF != MAM_MAGIC:
+            continue
+        decompressor.decompressBuffer(data, path)
+        files += 1
+        nbytes += len(data)
+    return files, nbytes, 0
+
+
+def runParse(paths, cliArgs, parser=None):
+    if parser is None:
+        from windowsprefetch import Prefetch as parser
+    files = nbytes = errors = 0
+    for path in paths:
+        try:
+            parser(path)
+        except Exception:
+            errors += 1
+            continue
+        files += 1
+        nbytes += os.path.getsize(path)
+    return files, nbytes, errors
+
+
+def runLazy(paths, cliArgs):
+    from windowsprefetch import LazyPrefetch
+    return runParse(paths, cliArgs, LazyPrefetch)
+
+
+def runCli(paths, cliArgs):
+    from windowsprefetch.scripts import prefetch
+    corpus = os.path.commonpath(paths) if len(paths) > 1 else paths[0]
+    sys.argv = ["prefetch.py", "-f", corpus, "--no-cache"] + cliArgs
+    # Error messages for unparseable files would swamp the report
+    with open(os.devnull, "w") as devnull:
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = devnull
+        try:
+            prefetch.main()
+            errors = 0
+        except SystemExit as e:
+            errors = 1 if e.code else 0
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+    return len(paths), sum(os.path.getsize(p) for p in paths), errors
+
+
+RUNNERS = {
+    "decompress": runDecompress,
+    "parse": runParse,
+    "lazy": runLazy,
+    "cli": runCli,
+}
+
+
+def child(phase, paths, cliArgs, queue):
+    start = time.perf_counter()
+    files, nbytes, errors = RUNNERS[phase](paths, cliArgs)
+    elapsed = time.perf_counter() - start
+    queue.put({
+        "phase": phase,
+        "files": files,
+        "bytes": nbytes,
+        "errors": errors,
+        "seconds": elapsed,
+        "files_per_sec": files / elapsed if elapsed else 0.0,
+        "mb_per_sec": nbytes / elapsed / 1e6 if elapsed else 0.0,
+        "peak_rss_mb": peakRss() / 1e6,
+    })
+
+
+def runPhase(phase, paths, cliArgs):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=child, args=(phase, paths, cliArgs, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("{} phase failed with exit code {}".format(phase, process.exitcode))
+    return queue.get()
+
+
+def main():
+    argv = sys.argv[1:]
+    cliArgs = []
+    if "--" in argv:
+        cliArgs = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    p = ArgumentParser(description="Benchmark prefetch parsing over a corpus")
+    p.add_argument("corpus", help="Directory of prefetch files")
+    p.add_argument("--phases", help="Comma separated phases to run (default: all of {})".format(",".join(PHASES)), default=",".join(PHASES))
+    p.add_argument("--repeat", help="Run each phase this many times and keep the fastest (default: 1)", type=int, default=1)
+    p.add_argument("--json", help="Print results as JSON instead of a table", action="store_true")
+    args = p.parse_args(argv)
+
+    phases = [phase for phase in args.phases.split(",") if phase]
+    for phase in phases:
+        if phase not in RUNNERS:
+            p.error("unknown phase {}".format(phase))
+
+    paths = listFiles(args.corpus)
+    if not paths:
+        p.error("no files in {}".format(args.corpus))
+
+    results = []
+    for phase in phases:
+        runs = [runPhase(phase, paths, cliArgs) for _ in range(max(1, args.repeat))]
+        results.append(min(runs, key=lambda r: r["seconds"]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print("{:<11} {:>8} {:>7} {:>9} {:>10} {:>8} {:>13}".format(
+        "Phase", "Files", "Errors", "Seconds", "Files/s", "MB/s", "Peak RSS MB"))
+    for r in results:
+        print("{:<11} {:>8} {:>7} {:>9.2f} {:>10.1f} {:>8.2f} {:>13.1f}".format(
+            r["phase"], r["files"], r["errors"], r["seconds"],
+            r["files_per_sec"], r["mb_per_sec"], r["peak_rss_mb"]))
+
+
+if __name__ == "__main__":
+    main()
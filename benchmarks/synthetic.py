@@ -0,0 +1,396 @@
+# Synthetic prefetch corpus generator for the benchmarks.
+#
+# Writes structurally valid prefetch files for format versions 17, 23, 26
+# and 30, uncompressed or MAM (LZXPRESS Huffman) compressed, with
+# configurable numbers of resources, volumes, directory strings and trace
+# chain entries. Generating and compressing each file in Python is slow, so
+# only --unique distinct files are built and the rest of the corpus is made
+# of copies under different names.
+#
+# Usage: python benchmarks/synthetic.py OUTDIR --count 10000
+
+
+import os
+import sys
+import heapq
+import random
+import struct
+import binascii
+from argparse import ArgumentParser
+
+
+# Per-version layout: file information size, last run time offset and
+# slots, run count offset, metrics / trace chain / volume entry sizes
+LAYOUTS = {
+    17: dict(fileInfo=68, lastRun=120, runSlots=1, runCount=144, metrics=20, trace=12, volume=40),
+    23: dict(fileInfo=156, lastRun=128, runSlots=1, runCount=152, metrics=32, trace=12, volume=104),
+    26: dict(fileInfo=220, lastRun=128, runSlots=8, runCount=208, metrics=32, trace=12, volume=104),
+    30: dict(fileInfo=220, lastRun=128, runSlots=8, runCount=208, metrics=32, trace=8, volume=96),
+}
+
+HEADER_SIZE = 84
+
+# A FILETIME in January 2016, the base for generated timestamps
+BASE_FILETIME = 130961088000000000
+
+# One hour in FILETIME units
+HOUR = 36000000000
+
+DLL_NAMES = [
+    "NTDLL.DLL", "KERNEL32.DLL", "KERNELBASE.DLL", "LOCALE.NLS", "USER32.DLL",
+    "GDI32.DLL", "MSVCRT.DLL", "ADVAPI32.DLL", "SECHOST.DLL", "RPCRT4.DLL",
+    "COMBASE.DLL", "SHELL32.DLL", "SHLWAPI.DLL", "OLE32.DLL", "IMM32.DLL",
+    "MSCTF.DLL", "UXTHEME.DLL", "DWMAPI.DLL", "VERSION.DLL", "WINBRAND.DLL",
+]
+
+DIRECTORY_NAMES = [
+    "WINDOWS", "SYSTEM32", "SYSWOW64", "PROGRAMDATA", "PROGRAM FILES",
+    "USERS", "APPDATA", "LOCAL", "TEMP", "GLOBALIZATION", "SORTING",
+]
+
+
+def utf16(text):
+    return text.encode("UTF-16-LE")
+
+
+def prefetchHash(name):
+    # Not the real Windows hash function, just a stable per-name value
+    return binascii.crc32(name.encode("ascii")) & 0xFFFFFFFF
+
+
+def build_prefetch(version, executable, rng, resources=60, volumes=1,
+                   directories=20, chain=8, runs=8):
+    """Return the bytes of an uncompressed prefetch file."""
+    layout = LAYOUTS[version]
+
+    if version >= 30:
+        volumeNames = ["\\VOLUME{{01d1217a9c4c{:04x}-{:08x}}}".format(i, rng.getrandbits(32)) for i in range(volumes)]
+    else:
+        volumeNames = ["\\DEVICE\\HARDDISKVOLUME{}".format(i + 1) for i in range(volumes)]
+
+    # Loaded resources, the executable itself among them
+    paths = []
+    for i in range(resources):
+        volume = volumeNames[i % volumes]
+        if i == 1:
+            name = executable
+        else:
+            name = DLL_NAMES[i % len(DLL_NAMES)]
+            if i >= len(DLL_NAMES):
+                name = "{}{}".format(i, name)
+        paths.append("{}\\WINDOWS\\SYSTEM32\\{}".format(volume, name))
+
+    # Filename strings section
+    filenames = bytearray()
+    nameOffsets = []
+    for path in paths:
+        nameOffsets.append(len(filenames))
+        filenames += utf16(path) + b"\x00\x00"
+
+    # Metrics and trace chains, one chain of `chain` entries per resource
+    metrics = bytearray()
+    traces = bytearray()
+    for i, path in enumerate(paths):
+        start = i * chain
+        reference = rng.randrange(1, 1 << 20) | (rng.randrange(1, 8) << 48)
+        if version == 17:
+            metrics += struct.pack("<5I", start, chain, nameOffsets[i], len(path), 2)
+        else:
+            metrics += struct.pack("<6IQ", start, chain, rng.randrange(1, 50), nameOffsets[i], len(path), 2, reference)
+        for k in range(chain):
+            blocks = rng.randrange(1, 64)
+            if version >= 30:
+                traces += struct.pack("<I2BH", blocks, 0, 255, 0)
+            else:
+                nextIndex = start + k + 1 if k < chain - 1 else 0xFFFFFFFF
+                traces += struct.pack("<2I2BH", nextIndex, blocks, 2, 1, 0)
+
+    # Volume information section: the entries, then per volume its path,
+    # an empty file reference block and its directory strings
+    entries = bytearray()
+    data = bytearray()
+    dataStart = layout["volume"] * volumes
+    for i, volumeName in enumerate(volumeNames):
+        pathOffset = dataStart + len(data)
+        data += utf16(volumeName) + b"\x00\x00"
+        fileRefOffset = dataStart + len(data)
+        data += struct.pack("<2I", 3, 0)
+        dirOffset = dataStart + len(data)
+        for d in range(directories):
+            parts = [DIRECTORY_NAMES[(d + k) % len(DIRECTORY_NAMES)] for k in range(1 + d % 4)]
+            dirPath = "{}\\{}".format(volumeName, "\\".join(parts))
+            if d >= len(DIRECTORY_NAMES):
+                dirPath += "\\{}".format(d)
+            data += struct.pack("<H", len(dirPath)) + utf16(dirPath) + b"\x00\x00"
+        entry = struct.pack("<2IQ5I", pathOffset, len(volumeName),
+                            BASE_FILETIME - rng.randrange(1, 1000) * HOUR,
+                            rng.getrandbits(32), fileRefOffset, 8, dirOffset, directories)
+        entries += entry + b"\x00" * (layout["volume"] - len(entry))
+    volumeSection = entries + data
+
+    metricsOffset = HEADER_SIZE + layout["fileInfo"]
+    traceOffset = metricsOffset + len(metrics)
+    filenameOffset = traceOffset + len(traces)
+    volumeOffset = filenameOffset + len(filenames)
+    fileSize = volumeOffset + len(volumeSection)
+
+    out = bytearray(metricsOffset)
+    struct.pack_into("<I4sII", out, 0, version, b"SCCA", 15 if version == 17 else 17, fileSize)
+    name = utf16(executable)[:58]
+    out[16:16 + len(name)] = name
+    struct.pack_into("<I", out, 76, prefetchHash(executable))
+    struct.pack_into("<9I", out, 84, metricsOffset, resources, traceOffset,
+                     resources * chain, filenameOffset, len(filenames),
+                     volumeOffset, volumes, len(volumeSection))
+
+    runCount = rng.randrange(1, 200)
+    lastRun = BASE_FILETIME + rng.randrange(0, 5000) * HOUR
+    for slot in range(min(layout["runSlots"], runs, runCount)):
+        struct.pack_into("<Q", out, layout["lastRun"] + 8 * slot, lastRun - slot * rng.randrange(1, 48) * HOUR)
+    struct.pack_into("<I", out, layout["runCount"], runCount)
+
+    return bytes(out + metrics + traces + filenames + volumeSection)
+
+
+# LZXPRESS Huffman compression ([MS-XCA] 2.2), the inverse of the decoder
+# in windowsprefetch.utils
+
+CHUNK_SIZE = 65536
+MAX_CODE_LENGTH = 15
+MIN_MATCH = 3
+MAX_OFFSET = 65535
+MAX_MATCH = 65535 + MIN_MATCH
+
+
+def findMatches(data, start, end):
+    # Greedy LZ77 parse of data[start:end], allowing matches to reach back
+    # into earlier chunks. Yields literal byte values and (length, offset)
+    hashes = {}
+    pos = start
+    while pos < end:
+        best = 0
+        offset = 0
+        if pos + MIN_MATCH <= end:
+            key = data[pos:pos + MIN_MATCH]
+            candidate = hashes.get(key)
+            hashes[key] = pos
+            if candidate is not None and pos - candidate <= MAX_OFFSET:
+                limit = min(end - pos, MAX_MATCH)
+                length = MIN_MATCH
+                # Extend 32 bytes at a time, then byte by byte
+                while length + 32 <= limit and data[candidate + length:candidate + length + 32] == data[pos + length:pos + length + 32]:
+                    length += 32
+                while length < limit and data[candidate + length] == data[pos + length]:
+                    length += 1
+                best = length
+                offset = pos - candidate
+        if best >= MIN_MATCH:
+            yield best, offset
+            pos += best
+        else:
+            yield data[pos]
+            pos += 1
+
+
+def codeLengths(frequencies):
+    # Huffman code lengths for the 512 symbols, limited to 15 bits by
+    # flattening the frequencies until the tree is shallow enough
+    frequencies = list(frequencies)
+    while True:
+        heap = [(f, symbol, None) for symbol, f in enumerate(frequencies) if f]
+        if len(heap) == 1:
+            lengths = [0] * 512
+            lengths[heap[0][1]] = 1
+            return lengths
+        heapq.heapify(heap)
+        nodeId = 512
+        children = {}
+        while len(heap) > 1:
+            f1, id1, _ = heapq.heappop(heap)
+            f2, id2, _ = heapq.heappop(heap)
+            children[nodeId] = (id1, id2)
+            heapq.heappush(heap, (f1 + f2, nodeId, None))
+            nodeId += 1
+
+        lengths = [0] * 512
+        stack = [(heap[0][1], 0)]
+        while stack:
+            node, depth = stack.pop()
+            if node in children:
+                stack.append((children[node][0], depth + 1))
+                stack.append((children[node][1], depth + 1))
+            else:
+                lengths[node] = depth
+        if max(lengths) <= MAX_CODE_LENGTH:
+            return lengths
+        frequencies = [(f >> 1) | 1 if f else 0 for f in frequencies]
+
+
+def canonicalCodes(lengths):
+    # Canonical codes in (length, symbol) order, as the decoder expects
+    codes = [0] * 512
+    code = 0
+    for bitLength in range(1, MAX_CODE_LENGTH + 1):
+        for symbol in range(512):
+            if lengths[symbol] == bitLength:
+                codes[symbol] = code
+                code += 1
+        code <<= 1
+    return codes
+
+
+def compress_xpress_huffman(data):
+    """Compress data with LZXPRESS Huffman and return the stream."""
+    out = bytearray()
+    size = len(data)
+    for chunkStart in range(0, max(size, 1), CHUNK_SIZE):
+        chunkEnd = min(chunkStart + CHUNK_SIZE, size)
+        symbols = []
+        frequencies = [0] * 512
+        for item in findMatches(data, chunkStart, chunkEnd):
+            if isinstance(item, int):
+                symbols.append((item, 0, 0, 0))
+                frequencies[item] += 1
+            else:
+                length, offset = item
+                offsetBits = offset.bit_length() - 1
+                lengthCode = min(length - MIN_MATCH, 15)
+                symbol = 256 + (offsetBits << 4) + lengthCode
+                symbols.append((symbol, length, offset, offsetBits))
+                frequencies[symbol] += 1
+        # The end of stream symbol is only written after the last chunk,
+        # but always being in the table keeps at least two codes defined
+        frequencies[256] += 1
+        if chunkEnd == size:
+            symbols.append((256, 0, 0, 0))
+
+        lengths = codeLengths(frequencies)
+        codes = canonicalCodes(lengths)
+        for i in range(256):
+            out.append(lengths[2 * i] | (lengths[2 * i + 1] << 4))
+
+        # The decoder keeps 32 bits of input loaded, refilling 16 bits at a
+        # time, and reads extra length bytes from after the last word it has
+        # loaded. Word slots are therefore reserved in the output as the
+        # decoder would load them, and filled in once the chunk is done.
+        words = []
+        slots = []
+        consumed = [0]
+
+        def reserve(count):
+            while len(slots) < count:
+                slots.append(len(out))
+                out.extend(b"\x00\x00")
+
+        def loaded():
+            return max(2, (consumed[0] + 15) // 16 + 1)
+
+        def writeBits(value, count):
+            for bit in range(count - 1, -1, -1):
+                word, position = divmod(consumed[0], 16)
+                if word == len(words):
+                    words.append(0)
+                if (value >> bit) & 1:
+                    words[word] |= 1 << (15 - position)
+                consumed[0] += 1
+
+        reserve(2)
+        for symbol, length, offset, offsetBits in symbols:
+            writeBits(codes[symbol], lengths[symbol])
+            if symbol < 256 or length == 0:
+                continue
+            reserve(loaded())
+            extra = length - MIN_MATCH
+            if extra >= 15:
+                if extra - 15 < 255:
+                    out.append(extra - 15)
+                else:
+                    out.append(255)
+                    out.extend(struct.pack("<H", extra))
+            if offsetBits:
+                writeBits(offset - (1 << offsetBits), offsetBits)
+
+        reserve(loaded())
+        for index, slot in enumerate(slots):
+            value = words[index] if index < len(words) else 0
+            struct.pack_into("<H", out, slot, value)
+    return bytes(out)
+
+
+def compress_mam(data, crc=False):
+    """Wrap compress_xpress_huffman(data) in a MAM header."""
+    signature = 0x044D414D | (0x80000000 if crc else 0)
+    header = struct.pack("<LL", signature, len(data))
+    compressed = compress_xpress_huffman(data)
+    if not crc:
+        return header + compressed
+    checksum = binascii.crc32(header)
+    checksum = binascii.crc32(struct.pack("<L", 0), checksum)
+    checksum = binascii.crc32(compressed, checksum)
+    return header + struct.pack("<L", checksum) + compressed
+
+
+def write_corpus(outdir, count, versions=(17, 23, 26, 30), compressed=(30,),
+                 unique=500, seed=1, crc=False, **sizes):
+    """Write count synthetic prefetch files into outdir.
+
+    Versions are used in rotation; versions listed in compressed are MAM
+    compressed. Only unique distinct files are generated, the rest are
+    copies of them under new names. Returns the total number of bytes
+    written.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    rng = random.Random(seed)
+    templates = []
+    for i in range(min(unique, count)):
+        version = versions[i % len(versions)]
+        executable = "SYNTH{:06d}.EXE".format(i)
+        data = build_prefetch(version, executable, rng, **sizes)
+        if version in compressed:
+            data = compress_mam(data, crc)
+        templates.append((executable, data))
+
+    total = 0
+    for i in range(count):
+        executable, data = templates[i % len(templates)]
+        name = "{}-{:08X}.pf".format(executable, prefetchHash("{}{}".format(executable, i)))
+        with open(os.path.join(outdir, name), "wb") as f:
+            f.write(data)
+        total += len(data)
+    return total
+
+
+def parseVersions(text):
+    return tuple(int(v) for v in text.split(",") if v)
+
+
+def main():
+    p = ArgumentParser(description="Write a synthetic prefetch corpus")
+    p.add_argument("outdir", help="Directory to write the corpus to")
+    p.add_argument("-n", "--count", help="Number of files to write (default: 10000)", type=int, default=10000)
+    p.add_argument("--versions", help="Comma separated format versions (default: 17,23,26,30)", type=parseVersions, default=(17, 23, 26, 30))
+    p.add_argument("--compressed", help="Versions to MAM compress (default: 30)", type=parseVersions, default=(30,))
+    p.add_argument("--crc", help="Include the optional CRC in MAM headers", action="store_true")
+    p.add_argument("--unique", help="Number of distinct files to generate (default: 500)", type=int, default=500)
+    p.add_argument("--resources", help="Resources per file (default: 60)", type=int, default=60)
+    p.add_argument("--volumes", help="Volumes per file (default: 1)", type=int, default=1)
+    p.add_argument("--directories", help="Directory strings per volume (default: 20)", type=int, default=20)
+    p.add_argument("--chain", help="Trace chain entries per resource (default: 8)", type=int, default=8)
+    p.add_argument("--seed", help="Random seed (default: 1)", type=int, default=1)
+    args = p.parse_args()
+
+    for version in args.versions + args.compressed:
+        if version not in LAYOUTS:
+            p.error("unsupported format version {}".format(version))
+    if args.resources < 2 or args.volumes < 1 or args.chain < 1:
+        p.error("--resources must be at least 2, --volumes and --chain at least 1")
+
+    total = write_corpus(args.outdir, args.count, args.versions, args.compressed,
+                         args.unique, args.seed, args.crc,
+                         resources=args.resources, volumes=args.volumes,
+                         directories=args.directories, chain=args.chain)
+    sys.stderr.write("Wrote {} files, {:.1f} MB, to {}\n".format(args.count, total / 1e6, args.outdir))
+
+
+if __name__ == "__main__":
+    main()
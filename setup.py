@@ -22,7 +22,7 @@ setup(
         'Topic :: Security',
         'License :: OSI Approved :: Apache Software License'
     ],
-    python_requires=">=3",
+    python_requires=">=3.7",
     keywords='DFIR Prefetch Forensics Incident Response Microsoft Windows',
     packages=find_packages(),
     entry_points={
@@ -0,0 +1,136 @@
+# Tests for the parse cache: least recently used eviction, the reset on a
+# FORMAT_VERSION change, and --cache-verify catching changed contents
+# which kept their size and mtime
+
+
+import os
+import sys
+import json
+import random
+import shutil
+import sqlite3
+import struct
+
+from windowsprefetch.cache import ParseCache, FORMAT_VERSION, content_digest
+from windowsprefetch.tasks import parseFile
+from windowsprefetch.windowsprefetch import Prefetch
+from windowsprefetch.scripts import prefetch
+
+
+WIN7 = os.path.join(os.path.dirname(__file__), os.pardir, "TestFiles", "Win7")
+
+NAME = "CALC.EXE-77FDF17F.pf"
+
+# A fixed mtime, in seconds, for files rewritten in place
+MTIME = 1000000000
+
+
+def payload(seed):
+    # A payload which compresses to about 1 KB
+    return {"data": random.Random(seed).getrandbits(8192).to_bytes(1024, "little").hex()}
+
+
+def paths(cache):
+    return set(os.path.basename(row[0]) for row in cache.db.execute("SELECT path FROM entries"))
+
+
+def test_get_and_put(tmp_path):
+    with ParseCache(str(tmp_path / "cache.db")) as cache:
+        assert cache.get("a.pf", 10, 20, "record") is None
+        cache.put("a.pf", 10, 20, "record", payload(0), "digest")
+        cache.flush()
+        assert cache.get("a.pf", 10, 20, "record") == payload(0)
+        # Another size, mtime or variant misses
+        assert cache.get("a.pf", 11, 20, "record") is None
+        assert cache.get("a.pf", 10, 21, "record") is None
+        assert cache.get("a.pf", 10, 20, "full") is None
+        assert (cache.hits, cache.misses) == (1, 4)
+    with ParseCache(str(tmp_path / "cache.db")) as cache:
+        assert cache.get("a.pf", 10, 20, "record") == payload(0)
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    with ParseCache(str(tmp_path / "cache.db")) as cache:
+        for i in range(10):
+            cache.put("{}.pf".format(i), 1, 1, "record", payload(i), "digest")
+        cache.flush()
+        total = cache.total_bytes
+        assert paths(cache) == set("{}.pf".format(i) for i in range(10))
+
+        # The two oldest entries are used again, so the next oldest go first
+        assert cache.get("0.pf", 1, 1, "record") == payload(0)
+        assert cache.get("1.pf", 1, 1, "record") == payload(1)
+        cache.max_bytes = total // 2
+        cache.flush()
+
+        kept = paths(cache)
+        assert {"0.pf", "1.pf", "9.pf"} <= kept
+        assert "2.pf" not in kept
+        assert len(kept) < 10
+        # Eviction leaves room below the limit
+        assert cache.total_bytes <= cache.max_bytes * 9 // 10
+        stored = cache.db.execute("SELECT SUM(nbytes) FROM entries").fetchone()[0]
+        assert cache.total_bytes == stored
+
+    with ParseCache(str(tmp_path / "cache.db"), max_bytes=total // 2) as cache:
+        assert cache.total_bytes == stored
+        assert paths(cache) == kept
+
+
+def test_other_format_version_is_dropped(tmp_path):
+    path = str(tmp_path / "cache.db")
+    with ParseCache(path) as cache:
+        cache.put("a.pf", 10, 20, "record", payload(0), "digest")
+
+    # Reopened by the same version, the entry is kept
+    with ParseCache(path) as cache:
+        assert cache.get("a.pf", 10, 20, "record") == payload(0)
+
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA user_version = {}".format(FORMAT_VERSION - 1))
+    db.close()
+    with ParseCache(path) as cache:
+        assert cache.get("a.pf", 10, 20, "record") is None
+        assert cache.total_bytes == 0
+        assert cache.db.execute("PRAGMA user_version").fetchone()[0] == FORMAT_VERSION
+
+
+def test_file_is_read_once_for_digest():
+    # The digest is taken of the buffer the parser read, not of a second read
+    path = os.path.join(WIN7, NAME)
+    _, record, error, cacheInfo, totals = parseFile((path, None, "record", "default", True, True))
+    assert error is None
+    with open(path, "rb") as f:
+        assert cacheInfo == (content_digest(f.read()), record["hash"])
+    assert totals["counters"]["reads"] == 1
+
+
+def run(monkeypatch, capsys, *args):
+    monkeypatch.setattr(sys, "argv", ["prefetch.py"] + list(args))
+    prefetch.main()
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_cache_verify(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / NAME)
+    cache = str(tmp_path / "cache.db")
+    shutil.copy(os.path.join(WIN7, NAME), path)
+    os.utime(path, (MTIME, MTIME))
+    first = run(monkeypatch, capsys, "-f", path, "-J", "--per-file", "--cache", cache)
+
+    # Rewrite a run time in place, keeping the size and mtime
+    with open(path, "rb") as f:
+        data = f.read()
+    runTime = Prefetch(path).runTimes[0]
+    with open(path, "wb") as f:
+        f.write(data.replace(struct.pack("<Q", runTime), struct.pack("<Q", runTime + 10000000), 1))
+    os.utime(path, (MTIME, MTIME))
+    changed = Prefetch(path).timestamps
+
+    # Without --cache-verify the stat values match and the entry is used
+    assert run(monkeypatch, capsys, "-f", path, "-J", "--per-file", "--cache", cache) == first
+    # With it the digest does not match, so the file is parsed again
+    verified = run(monkeypatch, capsys, "-f", path, "-J", "--per-file", "--cache", cache, "--cache-verify")
+    assert verified[0]["timestamps"] == changed != first[0]["timestamps"]
+    # and the new result replaces the stale entry
+    assert run(monkeypatch, capsys, "-f", path, "-J", "--per-file", "--cache", cache, "--cache-verify") == verified
@@ -0,0 +1,100 @@
+# Regression tests for the pure-Python LZXPRESS Huffman decoder, run over
+# the Windows 10 prefetch files in TestFiles
+
+
+import os
+import struct
+
+import pytest
+
+from windowsprefetch.utils import DecompressWin10, decompressXpressHuffman
+from windowsprefetch.windowsprefetch import Prefetch, LazyPrefetch
+
+
+WIN10 = os.path.join(os.path.dirname(__file__), os.pardir, "TestFiles", "Win10")
+
+# File name: (executable name, run count, decompressed size, resources)
+KNOWN = {
+    "CALC.EXE-3FBEF7FD.pf": ("CALC.EXE", 2, 47848, 63),
+    "CALCULATOR.EXE-6940BD5C.pf": ("CALCULATOR.EXE", 1, 99194, 103),
+    "CHROME.EXE-B3BA7868.pf": ("CHROME.EXE", 20, 116042, 282),
+    "CMD.EXE-D269B812.pf": ("CMD.EXE", 55, 25138, 62),
+    "DCODEDCODEDCODEDCODEDCODEDCOD-E65B9FE8.pf": ("DCODEDCODEDCODEDCODEDCODEDCOD", 2, 33606, 57),
+    "DEVENV.EXE-854D7862.pf": ("DEVENV.EXE", 54, 380690, 403),
+}
+
+
+def read(name):
+    with open(os.path.join(WIN10, name), "rb") as f:
+        return f.read()
+
+
+def test_every_file_is_known():
+    assert sorted(os.listdir(WIN10)) == sorted(KNOWN)
+
+
+@pytest.mark.parametrize("name", sorted(KNOWN))
+def test_decompress(name):
+    data = read(name)
+    out = DecompressWin10().decompressBuffer(data, name)
+    size = KNOWN[name][2]
+    assert len(out) == size == struct.unpack_from("<I", data, 4)[0]
+    version, signature, _, fileSize = struct.unpack_from("<I4s4sI", out)
+    assert version == 30
+    assert signature == b"SCCA"
+    assert fileSize == size
+
+
+@pytest.mark.parametrize("name", sorted(KNOWN))
+def test_parse(name):
+    executableName, runCount, size, resources = KNOWN[name]
+    p = Prefetch(os.path.join(WIN10, name))
+    assert p.version == 30
+    assert p.executableName == executableName
+    assert p.hash == name[-11:-3].lower()
+    assert p.runCount == runCount
+    assert len(p.resources) == resources
+
+
+def test_known_run_times():
+    p = Prefetch(os.path.join(WIN10, "CALC.EXE-3FBEF7FD.pf"))
+    assert p.timestamps == ["2016-01-11 22:08:20.985330", "2016-01-10 02:12:33.809541"]
+
+
+@pytest.mark.parametrize("name", sorted(KNOWN))
+def test_limit(name):
+    data = read(name)
+    full = DecompressWin10().decompressBuffer(data, name)
+    partial = DecompressWin10().decompressBuffer(data, name, limit=1000)
+    assert 1000 <= len(partial) < len(full)
+    assert partial == full[:len(partial)]
+    assert LazyPrefetch(os.path.join(WIN10, name), quick=True).runCount == KNOWN[name][1]
+
+
+def test_implausible_size_is_rejected():
+    # A small file claiming to decompress to nearly 4 GB must fail before
+    # anything is allocated for it
+    data = bytearray(read("CMD.EXE-D269B812.pf")[:316])
+    struct.pack_into("<I", data, 4, 0xF0000000)
+    with pytest.raises(ValueError, match="Implausible decompressed size"):
+        DecompressWin10().decompressBuffer(bytes(data), "huge.pf")
+
+
+def test_size_beyond_compressed_length_is_rejected():
+    data = bytearray(read("CMD.EXE-D269B812.pf"))
+    struct.pack_into("<I", data, 4, (len(data) // 260 + 1) * 65536)
+    with pytest.raises(ValueError, match="Implausible decompressed size"):
+        DecompressWin10().decompressBuffer(bytes(data), "inflated.pf")
+
+
+@pytest.mark.parametrize("name", sorted(KNOWN))
+def test_truncated_stream_is_rejected(name):
+    # Streams cut short anywhere, including in the middle of a chunk's code
+    # length table or of a match, fail with ValueError. The last 16-bit
+    # word may hold only padding bits, so it is left out
+    data = read(name)
+    size = KNOWN[name][2]
+    compressed = data[8:]
+    for end in range(0, len(compressed) - 2, len(compressed) // 25 + 1):
+        with pytest.raises(ValueError, match="Truncated"):
+            decompressXpressHuffman(compressed[:end], size)
@@ -0,0 +1,52 @@
+# Tests for FILETIME handling: raw values are kept on parsed objects and
+# only formatted for output, where values outside the range of datetime
+# come back raw instead of failing the file
+
+
+import os
+import struct
+
+from windowsprefetch.filetime import filetime_formatter
+from windowsprefetch.layouts import layout_for
+from windowsprefetch.records import full_record
+from windowsprefetch.windowsprefetch import Prefetch, LazyPrefetch
+
+
+WIN7 = os.path.join(os.path.dirname(__file__), os.pardir, "TestFiles", "Win7")
+
+# Beyond the year 9999, the last datetime can represent
+OUT_OF_RANGE = 0xFFFFFFFFFFFFFFF0
+
+
+def withVolumeCreationTime(name, filetime):
+    # Returns the contents of a Windows 7 file with its first volume's
+    # creation time replaced
+    with open(os.path.join(WIN7, name), "rb") as f:
+        data = bytearray(f.read())
+    p = Prefetch.from_bytes(bytes(data), name)
+    offset = dict((field[0], field[2]) for field in layout_for(p.version).volume.fields)["creationTime"]
+    struct.pack_into("<Q", data, p.volumesInformationOffset + offset, filetime)
+    return bytes(data)
+
+
+def test_formatter():
+    formatTime = filetime_formatter()
+    assert formatTime(130974525181093750) == "2016-01-16 21:15:18.109375"
+    assert formatTime(OUT_OF_RANGE) == OUT_OF_RANGE
+    assert filetime_formatter("iso")(130974525181093750) == "2016-01-16T21:15:18.109375Z"
+
+
+def test_volume_creation_time_is_raw():
+    p = Prefetch(os.path.join(WIN7, "CALC.EXE-77FDF17F.pf"))
+    assert p.volumesInformationArray[0]["Creation Time"] == 130974525181093750
+    assert "Creation Date" not in p.volumesInformationArray[0]
+
+
+def test_out_of_range_volume_creation_time():
+    data = withVolumeCreationTime("CALC.EXE-77FDF17F.pf", OUT_OF_RANGE)
+    for p in (Prefetch.from_bytes(data, "CALC.pf"), LazyPrefetch.from_bytes(data, "CALC.pf")):
+        assert p.volumesInformationArray[0]["Creation Time"] == OUT_OF_RANGE
+        volume = full_record(p)["volumes"][0]
+        assert volume["creation_time"] == OUT_OF_RANGE
+        assert volume["creation_date"] == OUT_OF_RANGE
+        assert "Creation Date: {}".format(OUT_OF_RANGE) in p.prettyFormat()
@@ -0,0 +1,126 @@
+# Tests for the inverted path index, built from the sample files in
+# TestFiles
+
+
+import os
+
+import pytest
+
+from windowsprefetch.index import PathIndex, normalize_path, KIND_RESOURCE, KIND_DIRECTORY
+from windowsprefetch.records import full_record
+from windowsprefetch.windowsprefetch import Prefetch
+
+
+TESTFILES = os.path.join(os.path.dirname(__file__), os.pardir, "TestFiles")
+
+WIN7 = os.path.join(TESTFILES, "Win7")
+
+NTDLL = "\\WINDOWS\\SYSTEM32\\NTDLL.DLL"
+
+
+def records(directory):
+    for name in sorted(os.listdir(directory)):
+        yield full_record(Prefetch(os.path.join(directory, name)))
+
+
+@pytest.fixture
+def index(tmp_path):
+    with PathIndex(str(tmp_path / "index.db")) as index:
+        for record in records(WIN7):
+            index.add(record, host="win7")
+        index.commit()
+        yield index
+
+
+def sources(results):
+    return sorted(set(os.path.basename(result["source"]) for result in results))
+
+
+def test_normalize_path():
+    assert normalize_path("\\DEVICE\\HARDDISKVOLUME2\\WINDOWS\\SYSTEM32\\NTDLL.DLL") == NTDLL
+    assert normalize_path("\\VOLUME{01d14fb2c3f4a5e6-88008c2f}\\Windows\\System32\\ntdll.dll") == NTDLL
+    assert normalize_path("C:/Windows/System32/ntdll.dll\x00") == NTDLL
+    assert normalize_path("C:\\") == "\\"
+
+
+def test_exact(index):
+    results = index.query(NTDLL)
+    assert sources(results) == sorted(os.listdir(WIN7))
+    assert all(result["path"] == NTDLL and result["host"] == "win7" for result in results)
+    for pattern in ("C:\\Windows\\System32\\ntdll.dll",
+                    "c:/windows/system32/ntdll.dll",
+                    "\\VOLUME{01d14fb2c3f4a5e6-88008c2f}\\WINDOWS\\SYSTEM32\\NTDLL.DLL",
+                    "\\DEVICE\\HARDDISKVOLUME1\\WINDOWS\\SYSTEM32\\NTDLL.DLL"):
+        assert index.query(pattern) == results
+
+
+def test_prefix(index):
+    results = index.query("C:\\Windows\\System32\\", "prefix", KIND_RESOURCE)
+    assert results
+    assert all(result["path"].startswith("\\WINDOWS\\SYSTEM32\\") for result in results)
+    assert index.query("/windows/system32/", "prefix", KIND_RESOURCE) == results
+    # The trailing separator is kept, so \WINDOWS\SYSTEM doesn't match \WINDOWS\SYSTEM32
+    assert not any(result["path"].startswith("\\WINDOWS\\SYSTEM32")
+                   for result in index.query("\\WINDOWS\\SYSTEM\\", "prefix"))
+
+
+def test_glob(index):
+    results = index.query("\\Windows\\System32\\nt*.dll", "glob")
+    assert NTDLL in set(result["path"] for result in results)
+    assert all(result["path"].startswith("\\WINDOWS\\SYSTEM32\\NT") for result in results)
+    for pattern in ("C:\\Windows\\System32\\nt*.dll",
+                    "\\VOLUME{01d14fb2c3f4a5e6-88008c2f}\\Windows\\System32\\nt*.dll",
+                    "\\DEVICE\\HARDDISKVOLUME2\\WINDOWS\\SYSTEM32\\NT*.DLL",
+                    "/Windows/System32/nt*.dll",
+                    "Windows/System32/nt*.dll"):
+        assert index.query(pattern, "glob") == results
+
+
+def test_glob_name(index):
+    # Without a separator the pattern matches the file or directory name
+    results = index.query("nt*.dll", "glob")
+    assert results
+    assert all(result["path"].rsplit("\\", 1)[1].startswith("NT") for result in results)
+    names = set(result["path"] for result in index.query("ntdll.dll", "name"))
+    assert names == {NTDLL, "\\WINDOWS\\SYSWOW64\\NTDLL.DLL"}
+
+
+def test_substring_and_kind(index):
+    directories = index.query("SYSTEM32", "substring", KIND_DIRECTORY)
+    assert directories
+    assert all(result["kind"] == KIND_DIRECTORY for result in directories)
+    assert {"\\WINDOWS\\SYSTEM32"} <= set(result["path"] for result in directories)
+
+
+def test_replace(index):
+    record = full_record(Prefetch(os.path.join(WIN7, "CALC.EXE-77FDF17F.pf")))
+    count = len(index.query(NTDLL))
+    assert index.is_current(record["source"], 100, 1) is False
+
+    # The same source indexed again replaces its rows rather than adding to them
+    index.add(record, 100, 1)
+    assert len(index.query(NTDLL)) == count
+    assert index.is_current(record["source"], 100, 1)
+    assert not index.is_current(record["source"], 100, 2)
+
+    # A changed file which no longer loads NTDLL.DLL drops out of its results
+    record["run_count"] += 1
+    record["resources"] = [resource for resource in record["resources"]
+                           if normalize_path(resource["path"]) != NTDLL]
+    index.add(record, 200, 2)
+    index.commit()
+    results = index.query(NTDLL)
+    assert len(results) == count - 1
+    assert "CALC.EXE-77FDF17F.pf" not in sources(results)
+    rows = [result for result in index.query("\\WINDOWS\\SYSTEM32\\CALC.EXE")
+            if result["source"] == record["source"]]
+    assert [result["run_count"] for result in rows] == [record["run_count"]]
+
+
+def test_reopen(tmp_path):
+    path = str(tmp_path / "index.db")
+    with PathIndex(path) as index:
+        for record in records(WIN7):
+            index.add(record)
+    with PathIndex(path) as index:
+        assert sources(index.query(NTDLL)) == sorted(os.listdir(WIN7))
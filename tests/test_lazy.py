@@ -0,0 +1,46 @@
+# Tests for LazyPrefetch: sections decoded on demand match those of
+# Prefetch, and a released buffer is read back once, not once per section
+
+
+import os
+
+import pytest
+
+from windowsprefetch.stats import ParseStats
+from windowsprefetch.windowsprefetch import Prefetch, LazyPrefetch
+
+
+TESTFILES = os.path.join(os.path.dirname(__file__), os.pardir, "TestFiles")
+
+FILES = [
+    os.path.join(TESTFILES, "Win10", "DEVENV.EXE-854D7862.pf"),
+    os.path.join(TESTFILES, "Win7", "CALC.EXE-77FDF17F.pf"),
+    os.path.join(TESTFILES, "XPPro", "CMD.EXE-087B4001.pf"),
+]
+
+
+def sections(p):
+    return (p.volumesInformationArray, p.directoryStringsArray, p.resources,
+            p.filenames, list(p.traceChainSummary()))
+
+
+@pytest.mark.parametrize("path", FILES)
+def test_sections_match_prefetch(path):
+    expected = sections(Prefetch(path, keepTraceChains=True))
+    assert sections(LazyPrefetch(path)) == expected
+    assert sections(LazyPrefetch(path, keepBuffer=True)) == expected
+    with open(path, "rb") as f:
+        data = f.read()
+    assert sections(LazyPrefetch.from_bytes(data, path, quick=True)) == expected
+
+
+@pytest.mark.parametrize("path", FILES)
+def test_released_buffer_is_read_once(path):
+    stats = ParseStats()
+    p = LazyPrefetch(path, stats=stats)
+    sections(p)
+    p.metrics
+    counts = stats.as_dict()
+    assert counts["counters"]["reads"] == 2
+    if counts["counters"].get("compressed"):
+        assert counts["phases"]["decompress"]["calls"] == 2
@@ -0,0 +1,104 @@
+# Tests for the parser service: malformed requests get an error response
+# carrying their id, and never reach the parser
+
+
+import io
+import os
+import json
+import base64
+
+import pytest
+
+from windowsprefetch import service
+from windowsprefetch.service import PrefetchService
+
+
+WIN7 = os.path.join(os.path.dirname(__file__), os.pardir, "TestFiles", "Win7")
+
+NAME = "CALC.EXE-77FDF17F.pf"
+
+
+@pytest.fixture
+def prefetch_service():
+    with PrefetchService() as s:
+        yield s
+
+
+def answer(s, request):
+    line = request if isinstance(request, str) else json.dumps(request)
+    return s.submit(line).get()
+
+
+def test_path_request(prefetch_service):
+    path = os.path.join(WIN7, NAME)
+    response = answer(prefetch_service, {"id": 1, "path": path})
+    assert response["id"] == 1
+    assert response["source"] == path
+    assert response["record"]["executable_name"] == "CALC.EXE"
+    assert answer(prefetch_service, path)["record"] == response["record"]
+
+
+def test_data_request(prefetch_service):
+    with open(os.path.join(WIN7, NAME), "rb") as f:
+        data = base64.b64encode(f.read()).decode("ascii")
+    response = answer(prefetch_service, {"id": "x", "name": NAME, "data": data, "variant": "full"})
+    assert response["id"] == "x"
+    assert response["source"] == NAME
+    assert response["record"]["resources"]
+
+
+def test_integer_path_leaves_the_descriptor_alone(prefetch_service, monkeypatch, tmp_path):
+    # An integer path would be opened, and then closed, as a file descriptor
+    def parseFile(task):
+        raise AssertionError("parsed {!r}".format(task[0]))
+    monkeypatch.setattr(service, "parseFile", parseFile)
+
+    with open(str(tmp_path / "out"), "w") as f:
+        response = answer(prefetch_service, {"id": 7, "path": f.fileno()})
+        assert not f.closed
+        os.fstat(f.fileno())
+        f.write("still open")
+    assert response == {"id": 7, "error": "Bad request: path must be a string"}
+
+
+@pytest.mark.parametrize("request_, error", [
+    ({"id": 1, "path": 1}, "path must be a string"),
+    ({"id": 2, "path": ["a.pf"]}, "path must be a string"),
+    ({"id": 3, "name": 5, "data": ""}, "name must be a string"),
+    ({"id": 4, "path": "a.pf", "time_format": 3}, "time_format must be a string"),
+    ({"id": 5, "path": "a.pf", "variant": "timeline"}, "unknown variant"),
+    ({"id": 6, "path": "a.pf", "variant": ["record"]}, "unknown variant"),
+    ({"id": 7, "data": "not base64!"}, "Bad request"),
+    ({"id": 8, "data": 12}, "Bad request"),
+    ({"id": 9}, "expected a path or data"),
+])
+def test_bad_request(prefetch_service, request_, error):
+    response = answer(prefetch_service, request_)
+    assert response["id"] == request_["id"]
+    assert error in response["error"]
+    assert "record" not in response
+
+
+@pytest.mark.parametrize("line", ["{not json", "{}}", '{"id": 1'])
+def test_bad_json(prefetch_service, line):
+    assert answer(prefetch_service, line)["error"].startswith("Bad request")
+
+
+def test_json_which_is_not_an_object(prefetch_service):
+    # Only lines starting with a brace are read as JSON requests; any other
+    # line, JSON or not, is a path
+    response = answer(prefetch_service, '[{"id": 1}]')
+    assert response["source"] == '[{"id": 1}]'
+    assert response["error"].startswith("FileNotFoundError")
+    assert answer(prefetch_service, "12")["error"].startswith("FileNotFoundError")
+
+
+def test_serve_answers_every_line(prefetch_service):
+    path = os.path.join(WIN7, NAME)
+    requests = [{"id": 1, "path": 1}, {"id": 2, "path": path}, {"id": 3, "time_format": None, "path": path}]
+    infile = io.StringIO("".join(json.dumps(request) + "\n" for request in requests))
+    outfile = io.StringIO()
+    prefetch_service.serve(infile, outfile)
+    responses = [json.loads(line) for line in outfile.getvalue().splitlines()]
+    assert [response["id"] for response in responses] == [1, 2, 3]
+    assert "error" in responses[0] and "record" in responses[1] and "error" in responses[2]
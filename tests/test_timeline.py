@@ -0,0 +1,83 @@
+# Tests for the merged timeline: spilling to temporary runs and merging
+# them gives the same rows, in the same order, as sorting in memory
+
+
+import os
+
+import pytest
+
+from windowsprefetch.records import timeline_record
+from windowsprefetch.timeline import Timeline, host_from_path
+from windowsprefetch.windowsprefetch import Prefetch
+
+
+TESTFILES = os.path.join(os.path.dirname(__file__), os.pardir, "TestFiles")
+
+
+def records(time_format="epoch"):
+    # (record, host) for every sample file, by host directory and name
+    for host in sorted(os.listdir(TESTFILES)):
+        directory = os.path.join(TESTFILES, host)
+        for name in sorted(os.listdir(directory)):
+            try:
+                p = Prefetch(os.path.join(directory, name))
+            except Exception:
+                continue
+            yield timeline_record(p, time_format), host
+
+
+def build(max_rows, tempdir=None):
+    timeline = Timeline(max_rows, tempdir)
+    for record, host in records():
+        timeline.add(record, host)
+    return timeline
+
+
+def test_in_memory_is_sorted():
+    with build(1000000) as timeline:
+        assert not timeline.runs
+        rows = list(timeline)
+    timestamps = [row["timestamp"] for row in rows]
+    assert timestamps == sorted(timestamps)
+    assert len(rows) == sum(len(record["run_times"]) for record, _ in records())
+
+
+@pytest.mark.parametrize("max_rows", [1, 7, 50])
+def test_spilled_runs_merge_to_the_same_rows(tmp_path, max_rows):
+    with build(1000000) as timeline:
+        expected = list(timeline)
+
+    tempdir = str(tmp_path)
+    timeline = build(max_rows, tempdir)
+    runs = [f for f, _ in timeline.runs]
+    assert len(runs) > 1
+    assert len(timeline) == len(expected)
+    rows = list(timeline)
+    timeline.close()
+
+    # Globally sorted, and identical to the in-memory result, ties included
+    timestamps = [row["timestamp"] for row in rows]
+    assert timestamps == sorted(timestamps)
+    assert rows == expected
+    # Every run file is closed, and nothing is left in the temporary directory
+    assert all(f.closed for f in runs)
+    assert timeline.runs == []
+    assert os.listdir(tempdir) == []
+
+
+def test_rows_carry_their_host():
+    with build(3) as timeline:
+        hosts = set(row["host"] for row in timeline)
+    assert hosts <= set(os.listdir(TESTFILES))
+    assert "Win10" in hosts and "XPPro" in hosts
+
+
+def test_host_from_path():
+    assert host_from_path("cases", os.path.join("cases", "host1", "CMD.EXE-4A81B364.pf")) == "host1"
+    assert host_from_path("cases", os.path.join("cases", "CMD.EXE-4A81B364.pf")) is None
+    assert host_from_path("cases.zip", "cases.zip!host2/Prefetch/CMD.EXE-4A81B364.pf") == "host2"
+
+
+def test_max_rows_must_be_positive():
+    with pytest.raises(ValueError):
+        Timeline(0)
@@ -0,0 +1,68 @@
+# Tests for watch mode: only run times newer than those seen before are
+# reported, whatever the file's run count
+
+
+import os
+import shutil
+import struct
+
+from windowsprefetch.watch import PrefetchWatcher
+from windowsprefetch.windowsprefetch import Prefetch
+
+
+WIN7 = os.path.join(os.path.dirname(__file__), os.pardir, "TestFiles", "Win7")
+
+NAME = "CALC.EXE-77FDF17F.pf"
+
+# One second, in FILETIME ticks
+SECOND = 10000000
+
+
+def withRunTime(filetime):
+    # Returns the sample file with its last run time replaced, and so the
+    # same size and run count
+    with open(os.path.join(WIN7, NAME), "rb") as f:
+        data = f.read()
+    runTime = Prefetch.from_bytes(data).runTimes[0]
+    return data.replace(struct.pack("<Q", runTime), struct.pack("<Q", filetime), 1)
+
+
+def write(path, data, mtime):
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, (mtime, mtime))
+
+
+def test_replaced_file_with_same_run_count(tmp_path):
+    path = str(tmp_path / NAME)
+    shutil.copy(os.path.join(WIN7, NAME), path)
+    os.utime(path, (1000000000, 1000000000))
+    runTime = Prefetch(path).runTimes[0]
+
+    watcher = PrefetchWatcher(str(tmp_path))
+    assert watcher.poll() == []
+    assert watcher.poll() == []
+
+    # Rewritten unchanged: nothing new
+    write(path, withRunTime(runTime), 1000000010)
+    assert watcher.poll() == []
+
+    # Replaced by a file with the same run count but a newer run
+    write(path, withRunTime(runTime + SECOND), 1000000020)
+    executions = watcher.poll()
+    p = Prefetch(path)
+    assert p.runTimes[0] == runTime + SECOND
+    assert [execution["timestamp"] for execution in executions] == p.timestamps
+    assert executions[0]["run_count"] == p.runCount
+
+    # An older run time coming back is not reported again
+    write(path, withRunTime(runTime), 1000000030)
+    assert watcher.poll() == []
+
+
+def test_new_file_reports_every_run(tmp_path):
+    watcher = PrefetchWatcher(str(tmp_path))
+    assert watcher.poll() == []
+    shutil.copy(os.path.join(WIN7, NAME), str(tmp_path / NAME))
+    executions = watcher.poll()
+    assert [execution["timestamp"] for execution in executions] == Prefetch(os.path.join(WIN7, NAME)).timestamps
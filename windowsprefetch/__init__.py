@@ -1,5 +1,31 @@
-from .windowsprefetch import Prefetch
-from .utils import DecompressWin10
-from .scripts import prefetch
+# The public names are imported on first use, so that importing the
+# package, or any one of its modules, does not load the parser, the
+# decompressor and the command line tool all at once
 
-__all__ = ["Prefetch", "DecompressWin10", "prefetch"]
\ No newline at end of file
+from importlib import import_module
+
+# Public name: (module, attribute, or None for the module itself)
+_LAZY = {
+    "Prefetch": (".windowsprefetch", "Prefetch"),
+    "LazyPrefetch": (".windowsprefetch", "LazyPrefetch"),
+    "DecompressWin10": (".utils", "DecompressWin10"),
+    "prefetch": (".scripts.prefetch", None),
+}
+
+__all__ = ["Prefetch", "LazyPrefetch", "DecompressWin10", "prefetch"]
+
+
+def __getattr__(name):
+    try:
+        module, attr = _LAZY[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = import_module(module, __name__)
+    if attr is not None:
+        value = getattr(value, attr)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
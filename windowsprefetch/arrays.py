@@ -0,0 +1,226 @@
+# Columnar representations of the fixed-stride arrays in a prefetch file.
+# Each field is held in its own typed array (NumPy arrays when NumPy is
+# installed, array.array otherwise) instead of one dict per entry, which
+# keeps millions of entries affordable in memory. NumPy is only imported
+# when the first array is decoded, so importing the parser stays cheap.
+# Entry layouts come from windowsprefetch.layouts, per format version.
+
+
+import sys
+from array import array
+
+from windowsprefetch.layouts import layout_for
+
+
+_numpy = None
+_numpyChecked = False
+
+
+def loadNumpy():
+    # Returns the numpy module, importing it on first use, or None when it
+    # is not installed
+    global _numpy, _numpyChecked
+    if not _numpyChecked:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            pass
+        _numpyChecked = True
+    return _numpy
+
+
+# NumPy types of the struct format characters used in entry layouts; the
+# characters double as array.array type codes when NumPy is missing
+NUMPY_TYPES = {"I": "<u4", "H": "<u2", "B": "u1", "Q": "<u8"}
+
+
+def numpyDtype(numpy, structure):
+    # A NumPy dtype matching a layouts.Structure, skipping its pad bytes
+    return numpy.dtype({
+        "names": [name for name, _, _ in structure.fields],
+        "formats": [NUMPY_TYPES[fmt] for _, fmt, _ in structure.fields],
+        "offsets": [offset for _, _, offset in structure.fields],
+        "itemsize": structure.size,
+    })
+
+
+def uint32Words(buf, offset, count):
+    # Returns count little-endian 32-bit words from buf as an array
+    words = array("I")
+    words.frombytes(buf[offset:offset + count * 4])
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+
+class MetricsArray(object):
+    """Every file metrics entry of a prefetch file, one typed array per field.
+
+    Entry i describes the resource at index i of Prefetch.resources.
+    averageDuration, mftEntryNumber and mftSeqNumber are None for format
+    version 17, which does not record them.
+    """
+
+    __slots__ = ("startTime", "duration", "averageDuration", "filenameOffset",
+                 "filenameLength", "flags", "mftEntryNumber", "mftSeqNumber")
+
+    def __init__(self, buf, offset, count, version):
+        structure = layout_for(version).metrics
+        end = offset + count * structure.size
+        if end > len(buf):
+            raise ValueError("Metrics array extends past the end of the file")
+
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+        numpy = loadNumpy()
+        if numpy is not None:
+            entries = numpy.frombuffer(buf, numpyDtype(numpy, structure), count, offset)
+            for name, _, _ in structure.fields:
+                if name == "fileReference":
+                    references = entries[name]
+                    self.mftEntryNumber = references & 0xFFFFFFFFFFFF
+                    self.mftSeqNumber = (references >> 48).astype(numpy.uint16)
+                else:
+                    setattr(self, name, entries[name].copy())
+            return
+
+        # Every field is a 32-bit word but the 64-bit file reference, so the
+        # array is read as words and each column taken with a strided slice
+        stride = structure.size // 4
+        words = uint32Words(buf, offset, count * stride)
+        for name, _, fieldOffset in structure.fields:
+            column = fieldOffset // 4
+            if name == "fileReference":
+                low = words[column::stride]
+                high = words[column + 1::stride]
+                self.mftEntryNumber = array("Q", [lo | (hi & 0xFFFF) << 32 for lo, hi in zip(low, high)])
+                self.mftSeqNumber = array("H", [hi >> 16 for hi in high])
+            else:
+                setattr(self, name, words[column::stride])
+
+    def __len__(self):
+        return len(self.startTime)
+
+    def entry(self, index):
+        """Return entry index as a dict, for display or debugging."""
+        entry = {}
+        for name in self.__slots__:
+            column = getattr(self, name)
+            entry[name] = None if column is None else int(column[index])
+        return entry
+
+    def resourceReferences(self, resources):
+        """Yield (resource, mftEntryNumber, mftSeqNumber) for each entry.
+
+        resources is the matching Prefetch.resources list; the NTFS
+        reference fields are None for format version 17.
+        """
+        if self.mftEntryNumber is None:
+            for resource in resources[:len(self)]:
+                yield resource, None, None
+            return
+        for resource, entry, sequence in zip(resources, self.mftEntryNumber, self.mftSeqNumber):
+            yield resource, int(entry), int(sequence)
+
+
+
+# Marks the last entry of a chain in format versions 17 to 26
+END_OF_CHAIN = 0xFFFFFFFF
+
+
+def traceChainColumn(name):
+    # Property returning one decoded column, or None if the format version
+    # does not have the field
+    return property(lambda self: self.decode().get(name))
+
+
+class TraceChainsArray(object):
+    """The trace chains array of a prefetch file, decoded on first use.
+
+    Only the raw bytes of the section are held until a column is read; the
+    whole array is then decoded in one pass into one typed array per field
+    and the raw bytes are released. Metrics entry i owns the chain of
+    metrics.duration[i] entries starting at index metrics.startTime[i].
+    Field names follow the libscca documentation; nextEntryIndex is None
+    for format version 30.
+    """
+
+    __slots__ = ("structure", "count", "raw", "columns")
+
+    nextEntryIndex = traceChainColumn("nextEntryIndex")
+    blockLoadCount = traceChainColumn("blockLoadCount")
+    unknown0 = traceChainColumn("unknown0")
+    unknown1 = traceChainColumn("unknown1")
+    unknown2 = traceChainColumn("unknown2")
+
+    def __init__(self, raw, version):
+        self.structure = layout_for(version).traceChain
+        self.count = len(raw) // self.structure.size
+        self.raw = raw
+        self.columns = None
+
+    def __len__(self):
+        return self.count
+
+    def decode(self):
+        """Decode every entry into typed columns and release the raw bytes."""
+        if self.columns is not None:
+            return self.columns
+
+        structure = self.structure
+        raw = self.raw[:self.count * structure.size]
+        columns = {}
+        numpy = loadNumpy()
+        if numpy is not None:
+            entries = numpy.frombuffer(raw, numpyDtype(numpy, structure), self.count)
+            for name, _, _ in structure.fields:
+                columns[name] = entries[name].copy()
+        else:
+            values = list(zip(*structure.iter_unpack(raw)))
+            for index, (name, code, _) in enumerate(structure.fields):
+                columns[name] = array(code, values[index] if values else ())
+
+        self.columns = columns
+        self.raw = None
+        return columns
+
+    def chain(self, start, length):
+        """Return the entry indexes of the chain beginning at start.
+
+        Format versions 17 to 26 follow the next entry links, format version
+        30 chains are the length entries from start onwards.
+        """
+        columns = self.decode()
+        if "nextEntryIndex" not in columns:
+            return range(start, min(start + length, self.count))
+
+        links = columns["nextEntryIndex"]
+        indexes = []
+        index = start
+        # A chain can never be longer than the array, which guards against
+        # link cycles in corrupt files
+        while index != END_OF_CHAIN and index < self.count and len(indexes) < self.count:
+            indexes.append(index)
+            index = int(links[index])
+        return indexes
+
+    def summary(self, metrics):
+        """Aggregate the chains of each metrics entry.
+
+        Returns (entryCounts, blockLoads): per metrics entry, the number of
+        trace chain entries in its chain and the sum of their block load
+        counts, as typed arrays in metrics (and so resources) order.
+        """
+        blockLoadCount = self.decode()["blockLoadCount"]
+        entryCounts = array("I")
+        blockLoads = array("Q")
+        for start, length in zip(metrics.startTime, metrics.duration):
+            indexes = self.chain(int(start), int(length))
+            entryCounts.append(len(indexes))
+            if isinstance(indexes, range):
+                blockLoads.append(int(sum(blockLoadCount[indexes.start:indexes.stop])))
+            else:
+                blockLoads.append(sum(int(blockLoadCount[i]) for i in indexes))
+        return entryCounts, blockLoads
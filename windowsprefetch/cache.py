@@ -0,0 +1,171 @@
+# On-disk cache of parse results, so repeated runs over the same evidence
+# skip files that have not changed since they were last parsed.
+#
+# Entries live in a SQLite database keyed by (path, variant), where variant
+# names what was cached for the file (a record, or pretty-printed text).
+# An entry is only used when the file's size and mtime still match, and,
+# when verify is set, when the digest of its contents matches as well. The
+# prefetch hash is stored alongside for inspecting the cache by hand; it
+# takes no part in lookups, which the digest already covers. The database
+# is kept under max_bytes by evicting the least recently used entries, and
+# emptied when it was filled by a parser of another FORMAT_VERSION.
+
+
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+
+
+# Default upper bound on the size of the cached payloads, in bytes
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# Environment variable naming a cache to use when --cache is not given
+CACHE_ENV = "PREFETCH_CACHE"
+
+# Version of the cached results, kept in the database's user_version. Bump
+# it whenever parsing or record output changes, so that results made by an
+# older parser are discarded instead of served
+FORMAT_VERSION = 2
+
+# Pending writes are committed in batches of this many entries
+BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    hash TEXT,
+    payload BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (path, variant)
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def content_digest(data):
+    """Return the digest stored with each entry for a file's contents."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_digest(path):
+    """Return content_digest() of the file at path."""
+    with open(path, "rb") as f:
+        return content_digest(f.read())
+
+
+class ParseCache(object):
+    """SQLite backed cache of JSON-serialisable parse results.
+
+    check_same_thread is passed to sqlite3.connect; with it False the cache
+    can be used from several threads, which must not call it at once.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, verify=False, check_same_thread=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=check_same_thread)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != FORMAT_VERSION:
+            self.db.executescript("DROP TABLE IF EXISTS entries; PRAGMA user_version = {};".format(FORMAT_VERSION))
+        self.db.executescript(SCHEMA)
+        self.total_bytes, self.clock = self.db.execute(
+            "SELECT COALESCE(SUM(nbytes), 0), COALESCE(MAX(last_used), 0) FROM entries").fetchone()
+        self.pending = []
+        self.touched = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def key(self, path):
+        # Entries are keyed on the absolute path so relative paths from
+        # different working directories share them
+        return os.path.abspath(path)
+
+    def get(self, path, size, mtime, variant):
+        """Return the cached payload for an unchanged file, or None."""
+        row = self.db.execute(
+            "SELECT size, mtime, digest, payload FROM entries WHERE path = ? AND variant = ?",
+            (self.key(path), variant)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            self.misses += 1
+            return None
+        if self.verify:
+            try:
+                if file_digest(path) != row[2]:
+                    self.misses += 1
+                    return None
+            except OSError:
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        self.clock += 1
+        self.touched.append((self.clock, self.key(path), variant))
+        if len(self.touched) >= BATCH_SIZE:
+            self.flush()
+        return json.loads(zlib.decompress(row[3]).decode("utf-8"))
+
+    def put(self, path, size, mtime, variant, payload, digest, pfhash=None):
+        """Store the payload parsed from a file with the given stat values."""
+        blob = zlib.compress(json.dumps(payload).encode("utf-8"))
+        self.clock += 1
+        self.pending.append((self.key(path), variant, size, mtime, digest,
+                             pfhash, blob, len(blob), self.clock))
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Commit pending entries and access times, then enforce max_bytes."""
+        with self.db:
+            if self.pending:
+                for entry in self.pending:
+                    old = self.db.execute(
+                        "SELECT nbytes FROM entries WHERE path = ? AND variant = ?",
+                        entry[:2]).fetchone()
+                    if old is not None:
+                        self.total_bytes -= old[0]
+                    self.total_bytes += entry[7]
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    self.pending)
+                self.pending = []
+            if self.touched:
+                self.db.executemany(
+                    "UPDATE entries SET last_used = ? WHERE path = ? AND variant = ?",
+                    self.touched)
+                self.touched = []
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Removes least recently used entries until the cache is back under
+        # 90% of max_bytes, leaving room before the next eviction
+        target = self.max_bytes * 9 // 10
+        rows = self.db.execute(
+            "SELECT rowid, nbytes FROM entries ORDER BY last_used")
+        doomed = []
+        for rowid, nbytes in rows:
+            if self.total_bytes <= target:
+                break
+            doomed.append((rowid,))
+            self.total_bytes -= nbytes
+        self.db.executemany("DELETE FROM entries WHERE rowid = ?", doomed)
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
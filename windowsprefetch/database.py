@@ -0,0 +1,171 @@
+# Bulk export of parsed prefetch files into a normalised SQLite database.
+#
+# Rows are collected from full records (see records.full_record) and
+# written with executemany, many files per transaction, so an import is
+# bound by parsing rather than by SQLite. Indexes are created once the data
+# is loaded, which is much faster than maintaining them row by row.
+#
+# Times are stored as raw FILETIMEs (100 ns intervals since 1601) in
+# INTEGER columns, which are the ones to sort and index on, next to text
+# columns in whatever format was asked for, which may not sort in time
+# order.
+
+
+import sqlite3
+
+
+# Files written per transaction
+BATCH_FILES = 5000
+
+# Largest value an SQLite INTEGER can hold; FILETIMEs are unsigned
+MAX_INTEGER = (1 << 63) - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prefetch (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    executable_name TEXT,
+    hash TEXT,
+    version INTEGER,
+    run_count INTEGER,
+    last_run_time INTEGER,
+    last_run TEXT,
+    mft_entry_number INTEGER,
+    mft_seq_number INTEGER
+);
+CREATE TABLE IF NOT EXISTS executions (
+    prefetch_id INTEGER NOT NULL REFERENCES prefetch (id),
+    slot INTEGER NOT NULL,
+    run_time INTEGER,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS volumes (
+    prefetch_id INTEGER NOT NULL REFERENCES prefetch (id),
+    volume INTEGER NOT NULL,
+    name TEXT,
+    creation_time INTEGER,
+    creation_date TEXT,
+    serial_number TEXT
+);
+CREATE TABLE IF NOT EXISTS directory_strings (
+    prefetch_id INTEGER NOT NULL REFERENCES prefetch (id),
+    volume INTEGER NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS resources (
+    prefetch_id INTEGER NOT NULL REFERENCES prefetch (id),
+    idx INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    mft_entry_number INTEGER,
+    mft_seq_number INTEGER
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS prefetch_executable_name ON prefetch (executable_name);
+CREATE INDEX IF NOT EXISTS prefetch_hash ON prefetch (hash);
+CREATE INDEX IF NOT EXISTS executions_run_time ON executions (run_time);
+CREATE INDEX IF NOT EXISTS executions_prefetch_id ON executions (prefetch_id);
+CREATE INDEX IF NOT EXISTS volumes_prefetch_id ON volumes (prefetch_id);
+CREATE INDEX IF NOT EXISTS directory_strings_prefetch_id ON directory_strings (prefetch_id);
+CREATE INDEX IF NOT EXISTS directory_strings_path ON directory_strings (path);
+CREATE INDEX IF NOT EXISTS resources_prefetch_id ON resources (prefetch_id);
+CREATE INDEX IF NOT EXISTS resources_path ON resources (path);
+"""
+
+
+def filetimeValue(filetime):
+    # A corrupt FILETIME too large for an INTEGER column is stored as NULL
+    return filetime if filetime <= MAX_INTEGER else None
+
+
+class SqliteExporter(object):
+    """Writes full records into the tables described by SCHEMA.
+
+    Records are buffered and inserted batch_files at a time; close() writes
+    whatever is left and creates the indexes. An existing database is
+    appended to.
+    """
+
+    def __init__(self, path, batch_files=BATCH_FILES):
+        self.path = path
+        self.batch_files = batch_files
+        self.db = sqlite3.connect(path)
+        # The output is a derived artefact which can be rebuilt, so trade
+        # crash safety for import speed
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("PRAGMA journal_mode = MEMORY")
+        self.db.executescript(SCHEMA)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(executions)")]
+        if "run_time" not in columns:
+            self.db.close()
+            raise ValueError("{} was written by an older version without raw times; "
+                             "export to a new database".format(path))
+        self.nextId = self.db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM prefetch").fetchone()[0]
+        self.files = 0
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def reset(self):
+        self.prefetchRows = []
+        self.executionRows = []
+        self.volumeRows = []
+        self.directoryRows = []
+        self.resourceRows = []
+
+    def write(self, record):
+        """Queue the rows for one full record."""
+        prefetchId = self.nextId
+        self.nextId += 1
+        runTimes = record["run_times"]
+        self.prefetchRows.append((
+            prefetchId, record["source"], record["executable_name"],
+            record["hash"], record["version"], record["run_count"],
+            filetimeValue(runTimes[0]) if runTimes else None, record["last_run"],
+            record["mft_entry_number"], record["mft_seq_number"]))
+        for slot, (runTime, timestamp) in enumerate(zip(runTimes, record["timestamps"])):
+            self.executionRows.append((prefetchId, slot, filetimeValue(runTime), timestamp))
+        for index, volume in enumerate(record["volumes"]):
+            self.volumeRows.append((prefetchId, index, volume["name"],
+                                    filetimeValue(volume["creation_time"]),
+                                    volume["creation_date"], volume["serial_number"]))
+        for index, paths in enumerate(record["directory_strings"]):
+            for path in paths:
+                self.directoryRows.append((prefetchId, index, path))
+        for index, resource in enumerate(record["resources"]):
+            self.resourceRows.append((prefetchId, index, resource["path"],
+                                      resource["mft_entry_number"],
+                                      resource["mft_seq_number"]))
+
+        self.files += 1
+        if len(self.prefetchRows) >= self.batch_files:
+            self.flush()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        """Insert the queued rows in a single transaction."""
+        if not self.prefetchRows:
+            return
+        with self.db:
+            self.db.executemany("INSERT INTO prefetch VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.prefetchRows)
+            self.db.executemany("INSERT INTO executions VALUES (?, ?, ?, ?)", self.executionRows)
+            self.db.executemany("INSERT INTO volumes VALUES (?, ?, ?, ?, ?, ?)", self.volumeRows)
+            self.db.executemany("INSERT INTO directory_strings VALUES (?, ?, ?)", self.directoryRows)
+            self.db.executemany("INSERT INTO resources VALUES (?, ?, ?, ?, ?)", self.resourceRows)
+        self.reset()
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.executescript(INDEXES)
+            self.db.commit()
+            self.db.close()
+            self.db = None
@@ -0,0 +1,237 @@
+# Finds prefetch files in (possibly deeply nested) triage collections.
+# Directories are walked with os.scandir so the stat information from each
+# directory entry is reused, and files are classified from their first 8
+# bytes instead of their name, so renamed prefetch files are found and
+# zero-filled or foreign files are skipped without being parsed. Zip and tar
+# archives of a collection are read in place, member by member.
+
+
+import os
+import re
+import struct
+import fnmatch
+import tarfile
+import zipfile
+import calendar
+from collections import namedtuple
+
+from windowsprefetch.layouts import LAYOUTS
+
+
+# Uncompressed prefetch format versions this package can parse
+SCCA_VERSIONS = tuple(sorted(LAYOUTS))
+
+# File kinds reported by classify_header()
+KIND_MAM = "MAM"
+KIND_SCCA = "SCCA"
+
+# XPRESS Huffman, the only MAM compression algorithm used for prefetch files
+MAM_XPRESS_HUFF = 4
+
+
+# Archive file name suffixes recognised by is_archive()
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+PrefetchCandidate = namedtuple("PrefetchCandidate", "path size mtime kind")
+
+# A prefetch file read from an archive; path is member_path(archive, name)
+ArchiveMember = namedtuple("ArchiveMember", "path size mtime kind data")
+
+
+def classify_header(header):
+    """Classify the first 8 bytes of a file.
+
+    Returns KIND_MAM for a MAM compressed file, KIND_SCCA for an
+    uncompressed prefetch file of a known version, and None otherwise.
+    """
+    if len(header) < 8:
+        return None
+    if header[:3] == b"MAM":
+        signature, size = struct.unpack("<LL", header)
+        if (signature >> 24) & 0x0F == MAM_XPRESS_HUFF and size > 0:
+            return KIND_MAM
+        return None
+    version, signature = struct.unpack("<L4s", header)
+    if signature == b"SCCA" and version in SCCA_VERSIONS:
+        return KIND_SCCA
+    return None
+
+
+def classify_file(path):
+    """Classify a file on disk by reading its first 8 bytes."""
+    with open(path, "rb") as f:
+        return classify_header(f.read(8))
+
+
+def compile_globs(patterns):
+    # Compiles shell globs into one case-insensitive regular expression
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns), re.IGNORECASE)
+
+
+def _matches(regex, name, relpath):
+    return regex.match(name) is not None or regex.match(relpath) is not None
+
+
+def iter_prefetch_files(root, include=None, exclude=None, max_depth=None,
+                        follow_symlinks=False, on_skip=None, classify=True):
+    """Yield a PrefetchCandidate for every prefetch file under root.
+
+    include and exclude are lists of glob patterns matched, case
+    insensitively, against each file name and its path relative to root;
+    exclude patterns also prune directories. max_depth limits recursion,
+    0 meaning only the files directly inside root. When root is a file it is
+    classified on its own and the globs are not applied.
+
+    Files which are empty or do not look like prefetch files are skipped;
+    on_skip, when given, is called with (path, reason) for each of them.
+    With classify=False no file is opened: every file is yielded from its
+    stat information alone, with a kind of None.
+    """
+    includeRegex = compile_globs(include)
+    excludeRegex = compile_globs(exclude)
+
+    if not os.path.isdir(root):
+        st = os.stat(root)
+        candidate = _classify(root, st, on_skip) if classify else _unclassified(root, st)
+        if candidate is not None:
+            yield candidate
+        return
+
+    stack = [(root, "", 0)]
+    while stack:
+        directory, reldir, depth = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            if on_skip is not None:
+                on_skip(directory, str(e))
+            continue
+
+        subdirs = []
+        for entry in entries:
+            relpath = os.path.join(reldir, entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if max_depth is not None and depth >= max_depth:
+                        continue
+                    if excludeRegex is not None and _matches(excludeRegex, entry.name, relpath):
+                        continue
+                    subdirs.append((entry.path, relpath, depth + 1))
+                    continue
+                if not entry.is_file(follow_symlinks=follow_symlinks):
+                    continue
+            except OSError:
+                continue
+
+            if includeRegex is not None and not _matches(includeRegex, entry.name, relpath):
+                continue
+            if excludeRegex is not None and _matches(excludeRegex, entry.name, relpath):
+                continue
+
+            try:
+                st = entry.stat(follow_symlinks=follow_symlinks)
+            except OSError as e:
+                if on_skip is not None:
+                    on_skip(entry.path, str(e))
+                continue
+            candidate = _classify(entry.path, st, on_skip) if classify else _unclassified(entry.path, st)
+            if candidate is not None:
+                yield candidate
+
+        # Walk subdirectories in the order they were listed
+        stack.extend(reversed(subdirs))
+
+
+def _classify(path, st, on_skip):
+    # Builds a candidate from a stat result, skipping files that are empty,
+    # unreadable or not prefetch files
+    if st.st_size < 8:
+        if on_skip is not None:
+            on_skip(path, "empty file" if st.st_size == 0 else "file too small")
+        return None
+    try:
+        kind = classify_file(path)
+    except OSError as e:
+        if on_skip is not None:
+            on_skip(path, str(e))
+        return None
+    if kind is None:
+        if on_skip is not None:
+            on_skip(path, "not a prefetch file")
+        return None
+    return PrefetchCandidate(path, st.st_size, st.st_mtime_ns, kind)
+
+
+def _unclassified(path, st):
+    return PrefetchCandidate(path, st.st_size, st.st_mtime_ns, None)
+
+
+def is_archive(path):
+    """Return True if path is a file named like a zip or tar archive."""
+    return path.lower().endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+
+
+def member_path(archive, name):
+    """Return the path shown for the member name of an archive."""
+    return "{}!{}".format(archive, name)
+
+
+def iter_archive_members(archive, include=None, exclude=None, on_skip=None):
+    """Yield an ArchiveMember for every prefetch file in a zip or tar archive.
+
+    Members are read one at a time, in archive order, and never written to
+    disk; tar archives, compressed or not, are read as a stream in a single
+    pass. include, exclude and on_skip are as for iter_prefetch_files, with
+    globs matched against each member's name and its path in the archive.
+    An archive which cannot be read is passed to on_skip as a whole.
+    """
+    includeRegex = compile_globs(include)
+    excludeRegex = compile_globs(exclude)
+
+    def wanted(name):
+        base = name.rstrip("/").rsplit("/", 1)[-1]
+        if includeRegex is not None and not _matches(includeRegex, base, name):
+            return False
+        if excludeRegex is not None and _matches(excludeRegex, base, name):
+            return False
+        return True
+
+    try:
+        if zipfile.is_zipfile(archive):
+            members = _iter_zip(archive, wanted)
+        else:
+            members = _iter_tar(archive, wanted)
+        for name, mtime, data in members:
+            path = member_path(archive, name)
+            kind = classify_header(data[:8])
+            if kind is None:
+                if on_skip is not None:
+                    on_skip(path, "not a prefetch file" if len(data) >= 8 else "file too small")
+                continue
+            yield ArchiveMember(path, len(data), mtime, kind, data)
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        if on_skip is not None:
+            on_skip(archive, str(e))
+
+
+def _iter_zip(archive, wanted):
+    # Yields (name, mtime in ns, data) for the wanted files in a zip file.
+    # Zip timestamps have no time zone and are taken as UTC
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not wanted(info.filename):
+                continue
+            mtime = calendar.timegm(info.date_time + (0, 0, -1)) * 1000000000
+            yield info.filename, mtime, zf.read(info)
+
+
+def _iter_tar(archive, wanted):
+    # Yields (name, mtime in ns, data) for the wanted files in a tar file
+    with tarfile.open(archive, "r|*") as tf:
+        for info in tf:
+            if not info.isfile() or not wanted(info.name):
+                continue
+            yield info.name, int(info.mtime) * 1000000000, tf.extractfile(info).read()
@@ -0,0 +1,65 @@
+# Win32 FILETIME handling. A FILETIME counts 100 nanosecond intervals since
+# 1601-01-01 UTC; parsed objects keep the raw integers and they are only
+# turned into text, in the chosen format, when records are written.
+#
+# Conversions use integer arithmetic throughout. Dividing by 10.0 first, as
+# earlier versions did, loses precision: current FILETIMEs are above 2**53
+# microseconds' worth of ticks, so the float result can be a microsecond or
+# two off.
+
+
+from datetime import datetime, timedelta
+
+
+FILETIME_EPOCH = datetime(1601, 1, 1)
+
+# The Unix epoch as a FILETIME
+UNIX_EPOCH_FILETIME = 116444736000000000
+
+TICKS_PER_SECOND = 10000000
+
+# Named output formats; any other format string is passed to strftime
+TIME_FORMATS = ("default", "iso", "epoch")
+
+
+def filetime_to_datetime(filetime):
+    """Return a FILETIME as a naive UTC datetime, truncated to microseconds."""
+    return FILETIME_EPOCH + timedelta(microseconds=filetime // 10)
+
+
+def filetime_to_epoch(filetime):
+    """Return a FILETIME as (fractional) seconds since the Unix epoch."""
+    seconds, ticks = divmod(filetime - UNIX_EPOCH_FILETIME, TICKS_PER_SECOND)
+    return seconds + ticks / float(TICKS_PER_SECOND)
+
+
+def filetime_formatter(time_format="default"):
+    """Return a function formatting FILETIMEs according to time_format.
+
+    "default" gives str(datetime), e.g. 2016-01-16 20:26:42.515109, "iso"
+    ISO 8601 with microseconds and a Z suffix, "epoch" seconds since the
+    Unix epoch as a float, and any other value is used as a strftime
+    format. Values outside the range of datetime are returned as the raw
+    integer rather than raising.
+    """
+    if time_format == "epoch":
+        return filetime_to_epoch
+
+    if time_format == "default":
+        convert = lambda dt: str(dt)
+    elif time_format == "iso":
+        convert = lambda dt: dt.isoformat(timespec="microseconds") + "Z"
+    else:
+        convert = lambda dt: dt.strftime(time_format)
+
+    def formatter(filetime):
+        try:
+            return convert(filetime_to_datetime(filetime))
+        except OverflowError:
+            return filetime
+    return formatter
+
+
+def format_filetimes(filetimes, time_format="default"):
+    """Return a list of FILETIMEs formatted according to time_format."""
+    return list(map(filetime_formatter(time_format), filetimes))
@@ -0,0 +1,268 @@
+# Persistent inverted index from the paths prefetch files reference to the
+# files themselves, answering questions such as "which programs loaded this
+# DLL, on which hosts and when" without parsing anything again.
+#
+# Every resource and directory string is normalised (upper case, trailing
+# NUL and volume prefix or drive letter removed, so that
+# \VOLUME{...}\WINDOWS\SYSTEM32\NTDLL.DLL and
+# \DEVICE\HARDDISKVOLUME2\WINDOWS\SYSTEM32\NTDLL.DLL are one path) and
+# stored once in the paths table, with a postings table linking paths to
+# the files which reference them. Files are keyed by their source and can
+# be added, replaced or removed one at a time.
+
+
+import re
+import json
+import sqlite3
+
+
+# Files written per transaction
+BATCH_FILES = 1000
+
+# Query modes accepted by PathIndex.query
+MATCH_MODES = ("exact", "prefix", "glob", "substring", "name")
+
+# Posting kinds
+KIND_RESOURCE = "resource"
+KIND_DIRECTORY = "directory"
+
+# Volume prefixes of the paths in prefetch files, and drive letters so
+# that paths can be given as they appear on the live system
+VOLUME_PREFIX = re.compile(r"^(?:[A-Z]:|\\VOLUME\{[^}]*\}|\\DEVICE\\[^\\]+)", re.IGNORECASE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL UNIQUE,
+    size INTEGER,
+    mtime INTEGER,
+    host TEXT,
+    executable_name TEXT,
+    hash TEXT,
+    run_count INTEGER,
+    last_run TEXT,
+    timestamps TEXT
+);
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    basename TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS paths_basename ON paths (basename);
+CREATE TABLE IF NOT EXISTS postings (
+    path_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    PRIMARY KEY (path_id, file_id, kind)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_file_id ON postings (file_id);
+"""
+
+QUERY = """
+SELECT f.executable_name, f.hash, f.host, f.run_count, f.last_run,
+       f.timestamps, f.source, p.path, o.kind
+FROM paths p
+JOIN postings o ON o.path_id = p.id
+JOIN files f ON f.id = o.file_id
+WHERE {}
+ORDER BY p.path, f.executable_name, f.source, o.kind
+"""
+
+# CSV header names and the query result keys they are read from
+QUERY_COLUMNS = (
+    ("Path", "path"),
+    ("Kind", "kind"),
+    ("Executable Name", "executable_name"),
+    ("Prefetch Hash", "hash"),
+    ("Run Count", "run_count"),
+    ("Last Run", "last_run"),
+    ("Host", "host"),
+    ("Source", "source"),
+)
+
+
+def normalize_path(path):
+    """Return the form of a path used as an index key."""
+    path = path.rstrip("\x00").replace("/", "\\").upper()
+    path = _strip_volume(path)
+    return path.rstrip("\\") or "\\"
+
+
+def _strip_volume(path):
+    # Removes the volume prefix or drive letter of a path
+    return VOLUME_PREFIX.sub("", path)
+
+
+def basename(path):
+    return path.rsplit("\\", 1)[-1]
+
+
+def _after_prefix(prefix):
+    # The smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _glob_prefix(pattern):
+    # The literal text before the first glob metacharacter
+    match = re.match(r"[^*?\[]*", pattern)
+    return match.group(0)
+
+
+def _normalize_glob(pattern):
+    # Normalises a glob pattern as normalize_path does a path. The volume
+    # prefix is only removed when it lies wholly in the literal text and
+    # ends at a separator, so \DEVICE\HARDDISK*\... is left alone
+    pattern = pattern.replace("/", "\\").upper()
+    prefix = _glob_prefix(pattern)
+    stripped = _strip_volume(prefix)
+    end = len(prefix) - len(stripped)
+    if end and pattern[end:end + 1] in ("\\", ""):
+        pattern = pattern[end:]
+    elif prefix and "\\" in pattern and not pattern.startswith("\\"):
+        # Indexed paths are rooted, so WINDOWS\*.EXE means \WINDOWS\*.EXE
+        pattern = "\\" + pattern
+    return pattern
+
+
+class PathIndex(object):
+    """An inverted index of resource and directory paths in SQLite.
+
+    add() takes full records (see records.full_record). A file whose source
+    is already indexed is replaced, and is_current() tells whether a file
+    on disk needs indexing again at all. Pending changes are committed
+    every batch_files files and by close().
+    """
+
+    def __init__(self, path, batch_files=BATCH_FILES):
+        self.path = path
+        self.batch_files = batch_files
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.pathIds = {}
+        self.pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_current(self, source, size, mtime):
+        """Return True if source is indexed with this size and mtime."""
+        row = self.db.execute("SELECT size, mtime FROM files WHERE source = ?", (source,)).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime
+
+    def pathId(self, path):
+        # Returns the ID of a normalised path, adding it if needed
+        pathId = self.pathIds.get(path)
+        if pathId is None:
+            row = self.db.execute("SELECT id FROM paths WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                pathId = self.db.execute("INSERT INTO paths (path, basename) VALUES (?, ?)",
+                                         (path, basename(path))).lastrowid
+            else:
+                pathId = row[0]
+            self.pathIds[path] = pathId
+        return pathId
+
+    def add(self, record, size=None, mtime=None, host=None):
+        """Index one full record, replacing any earlier entry for its source."""
+        self.remove(record["source"])
+        fileId = self.db.execute(
+            "INSERT INTO files (source, size, mtime, host, executable_name, hash, run_count, last_run, timestamps)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (record["source"], size, mtime, host, record["executable_name"],
+             record["hash"], record["run_count"], record["last_run"],
+             json.dumps(record["timestamps"]))).lastrowid
+
+        postings = set()
+        for resource in record["resources"]:
+            postings.add((self.pathId(normalize_path(resource["path"])), fileId, KIND_RESOURCE))
+        for paths in record["directory_strings"]:
+            for path in paths:
+                postings.add((self.pathId(normalize_path(path)), fileId, KIND_DIRECTORY))
+        self.db.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+
+        self.pending += 1
+        if self.pending >= self.batch_files:
+            self.commit()
+
+    def remove(self, source):
+        """Remove a file from the index; paths left unreferenced are kept."""
+        row = self.db.execute("SELECT id FROM files WHERE source = ?", (source,)).fetchone()
+        if row is not None:
+            self.db.execute("DELETE FROM postings WHERE file_id = ?", row)
+            self.db.execute("DELETE FROM files WHERE id = ?", row)
+
+    def query(self, pattern, mode="exact", kind=None):
+        """Return the files referencing paths which match pattern.
+
+        mode is one of MATCH_MODES: "exact", "prefix" and "substring" match
+        the normalised path, "name" matches the file or directory name
+        alone, and "glob" matches a shell pattern against the normalised
+        path, or against the name when the pattern has no separator. kind limits
+        the results to KIND_RESOURCE or KIND_DIRECTORY paths. Each result
+        is a dict with the file's details and the matching path.
+        """
+        if mode == "name":
+            value = pattern.upper()
+            column = "p.basename"
+        elif mode in ("exact", "prefix"):
+            value = normalize_path(pattern)
+            if mode == "prefix" and pattern.endswith(("\\", "/")) and value != "\\":
+                # Keep the separator, so \WINDOWS\TEMP\ does not match \WINDOWS\TEMPLATES
+                value += "\\"
+            column = "p.path"
+        elif mode == "glob":
+            value = _normalize_glob(pattern)
+            column = "p.path" if "\\" in value else "p.basename"
+        else:
+            value = pattern.upper().replace("/", "\\")
+            column = "p.path"
+
+        if mode in ("exact", "name"):
+            conditions, params = ["{} = ?".format(column)], [value]
+        elif mode == "prefix":
+            conditions, params = ["p.path >= ?", "p.path < ?"], [value, _after_prefix(value)]
+        elif mode == "glob":
+            conditions, params = ["{} GLOB ?".format(column)], [value]
+            # A literal prefix lets SQLite use the index on the column
+            prefix = _glob_prefix(value)
+            if prefix:
+                conditions += ["{} >= ?".format(column), "{} < ?".format(column)]
+                params += [prefix, _after_prefix(prefix)]
+        elif mode == "substring":
+            conditions, params = ["instr(p.path, ?) > 0"], [value]
+        else:
+            raise ValueError("Unknown match mode {!r}".format(mode))
+
+        if kind is not None:
+            conditions.append("o.kind = ?")
+            params.append(kind)
+
+        results = []
+        for row in self.db.execute(QUERY.format(" AND ".join(conditions)), params):
+            (executableName, pfhash, host, runCount, lastRun, timestamps,
+             source, path, pathKind) = row
+            results.append({
+                "executable_name": executableName,
+                "hash": pfhash,
+                "host": host,
+                "run_count": runCount,
+                "last_run": lastRun,
+                "timestamps": json.loads(timestamps),
+                "source": source,
+                "path": path,
+                "kind": pathKind,
+            })
+        return results
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        if self.db is not None:
+            self.commit()
+            self.db.close()
+            self.db = None
@@ -0,0 +1,179 @@
+# On-disk layouts of the fixed-size structures in a prefetch file, per
+# format version. Each structure is described once, as a list of (name,
+# struct format) fields with None for the bytes no one knows the meaning
+# of, and compiled to a struct.Struct when the module is loaded, so
+# decoding a structure is a single unpack call whatever its size. Parsers,
+# the columnar arrays and file discovery all pick the layout by the version
+# in the (decompressed) header; supporting a new Windows version means
+# adding its entry to LAYOUTS and nothing else.
+
+
+import struct
+from collections import namedtuple
+
+
+# The file header, 84 bytes at offset 0 in every version
+HEADER_FIELDS = [
+    ("version", "I"),
+    ("signature", "I"),
+    (None, "4x"),
+    ("fileSize", "I"),
+    ("executableName", "60s"),
+    ("hash", "I"),
+    (None, "4x"),
+]
+
+# Section offsets and counts which start every file information block
+SECTION_FIELDS = [
+    ("metricsOffset", "I"),
+    ("metricsCount", "I"),
+    ("traceChainsOffset", "I"),
+    ("traceChainsCount", "I"),
+    ("filenameStringsOffset", "I"),
+    ("filenameStringsSize", "I"),
+    ("volumesInformationOffset", "I"),
+    ("volumesCount", "I"),
+    ("volumesInformationSize", "I"),
+]
+
+# File information, following the header
+FILE_INFORMATION17_FIELDS = SECTION_FIELDS + [
+    ("lastRunTime", "8s"),
+    (None, "16x"),
+    ("runCount", "I"),
+    (None, "4x"),
+]
+
+FILE_INFORMATION23_FIELDS = SECTION_FIELDS + [
+    (None, "8x"),
+    ("lastRunTime", "8s"),
+    (None, "16x"),
+    ("runCount", "I"),
+    (None, "84x"),
+]
+
+# Versions 26 and later keep the last eight run times
+FILE_INFORMATION26_FIELDS = SECTION_FIELDS + [
+    (None, "8x"),
+    ("lastRunTime", "64s"),
+    (None, "16x"),
+    ("runCount", "I"),
+    (None, "92x"),
+]
+
+# File metrics entries. The first is read with the summary; the whole
+# array is decoded by arrays.MetricsArray
+METRICS17_FIELDS = [
+    ("startTime", "I"),
+    ("duration", "I"),
+    ("filenameOffset", "I"),
+    ("filenameLength", "I"),
+    ("flags", "I"),
+]
+
+METRICS23_FIELDS = [
+    ("startTime", "I"),
+    ("duration", "I"),
+    ("averageDuration", "I"),
+    ("filenameOffset", "I"),
+    ("filenameLength", "I"),
+    ("flags", "I"),
+    ("fileReference", "Q"),
+]
+
+# Trace chain entries, decoded by arrays.TraceChainsArray. Field names
+# follow the libscca documentation
+TRACECHAIN17_FIELDS = [
+    ("nextEntryIndex", "I"),
+    ("blockLoadCount", "I"),
+    ("unknown0", "B"),
+    ("unknown1", "B"),
+    ("unknown2", "H"),
+]
+
+# Version 30 stores each chain contiguously, with no next entry index
+TRACECHAIN30_FIELDS = [
+    ("blockLoadCount", "I"),
+    ("unknown0", "B"),
+    ("unknown1", "B"),
+    ("unknown2", "H"),
+]
+
+# Volume information entries, starting with the fields common to every
+# version
+VOLUME_FIELDS = [
+    ("pathOffset", "I"),
+    ("pathLength", "I"),
+    ("creationTime", "Q"),
+    ("serialNumber", "I"),
+    ("fileRefOffset", "I"),
+    ("fileRefSize", "I"),
+    ("dirStringsOffset", "I"),
+    ("dirStringsCount", "I"),
+]
+
+VOLUME17_FIELDS = VOLUME_FIELDS + [(None, "4x")]
+
+VOLUME23_FIELDS = VOLUME_FIELDS + [(None, "68x")]
+
+VOLUME30_FIELDS = VOLUME_FIELDS + [(None, "60x")]
+
+
+class Structure(object):
+    """A little-endian structure compiled from a list of fields.
+
+    names lists the named fields in the order unpack_from() returns them,
+    fields gives (name, format, offset) for each of them, and size is the
+    number of bytes the structure takes up.
+    """
+
+    __slots__ = ("names", "fields", "struct", "size", "unpack_from", "iter_unpack")
+
+    def __init__(self, fields):
+        self.names = tuple(name for name, _ in fields if name is not None)
+        self.fields = []
+        offset = 0
+        for name, fmt in fields:
+            if name is not None:
+                self.fields.append((name, fmt, offset))
+            offset += struct.calcsize("<" + fmt)
+        self.fields = tuple(self.fields)
+        self.struct = struct.Struct("<" + "".join(fmt for _, fmt in fields))
+        self.size = self.struct.size
+        self.unpack_from = self.struct.unpack_from
+        self.iter_unpack = self.struct.iter_unpack
+
+    def __repr__(self):
+        return "Structure({})".format(", ".join(self.names))
+
+
+# Everything that differs between format versions
+Layout = namedtuple("Layout", "version fileInformation metrics volume traceChain")
+
+HEADER = Structure(HEADER_FIELDS)
+
+LAYOUTS = {
+    17: Layout(17, Structure(FILE_INFORMATION17_FIELDS), Structure(METRICS17_FIELDS),
+               Structure(VOLUME17_FIELDS), Structure(TRACECHAIN17_FIELDS)),
+    23: Layout(23, Structure(FILE_INFORMATION23_FIELDS), Structure(METRICS23_FIELDS),
+               Structure(VOLUME23_FIELDS), Structure(TRACECHAIN17_FIELDS)),
+    26: Layout(26, Structure(FILE_INFORMATION26_FIELDS), Structure(METRICS23_FIELDS),
+               Structure(VOLUME23_FIELDS), Structure(TRACECHAIN17_FIELDS)),
+    30: Layout(30, Structure(FILE_INFORMATION26_FIELDS), Structure(METRICS23_FIELDS),
+               Structure(VOLUME30_FIELDS), Structure(TRACECHAIN30_FIELDS)),
+}
+# Windows 11 writes version 31 files in the version 30 layout
+LAYOUTS[31] = LAYOUTS[30]._replace(version=31)
+
+# Bytes holding the header, the largest file information block and the
+# first metrics entry in the usual layout
+SUMMARY_SIZE = HEADER.size + max(layout.fileInformation.size + layout.metrics.size
+                                 for layout in LAYOUTS.values())
+
+
+def layout_for(version):
+    """Return the Layout of a format version, or raise ValueError."""
+    try:
+        return LAYOUTS[version]
+    except KeyError:
+        raise ValueError("Unsupported prefetch format version {}".format(version))
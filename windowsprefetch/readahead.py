@@ -0,0 +1,89 @@
+# Read-ahead for slow storage. A few threads read whole files into memory
+# ahead of the parser, so waiting on the disk (or a mounted image, or a
+# network share) overlaps with parsing and decompression instead of
+# alternating with it. How far ahead they read is bounded both in files and
+# in bytes.
+
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from windowsprefetch.stats import NULL_STATS
+
+
+# Files read ahead of the parser
+DEFAULT_DEPTH = 32
+
+# Upper bound on the bytes read but not yet handed to the parser
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Reader threads
+DEFAULT_THREADS = 4
+
+
+def readFile(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def iter_readahead(items, source, depth=DEFAULT_DEPTH, max_bytes=DEFAULT_MAX_BYTES,
+                   threads=DEFAULT_THREADS, stats=None):
+    """Yield (item, data) for every item, in order, with files read ahead.
+
+    source(item) returns the (path, size) of the file to read for an item,
+    or None when it needs no reading, in which case data is None. data is
+    also None when a read fails, leaving the caller to open the file itself
+    and report the error as usual.
+
+    At most depth files, and at most max_bytes of data by the sizes given,
+    are read ahead of the consumer; a single file larger than max_bytes is
+    still read. Time spent waiting for a read to finish is reported to
+    stats as the "readWait" phase.
+    """
+    if depth < 1 or threads < 1:
+        raise ValueError("depth and threads must be at least 1")
+    if stats is None:
+        stats = NULL_STATS
+
+    items = iter(items)
+    pending = deque()
+    pendingBytes = 0
+    exhausted = False
+
+    with ThreadPoolExecutor(threads) as executor:
+        try:
+            while True:
+                while not exhausted and len(pending) < depth and (not pending or pendingBytes < max_bytes):
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    file = source(item)
+                    if file is None:
+                        pending.append((item, None, 0))
+                    else:
+                        path, size = file
+                        pending.append((item, executor.submit(readFile, path), size))
+                        pendingBytes += size
+
+                if not pending:
+                    return
+
+                item, future, size = pending.popleft()
+                pendingBytes -= size
+                data = None
+                if future is not None:
+                    try:
+                        with stats.phase("readWait"):
+                            data = future.result()
+                        stats.count("reads")
+                        stats.count("bytesRead", len(data))
+                    except OSError:
+                        data = None
+                yield item, data
+        finally:
+            # Reads not yet started are dropped when the consumer stops early
+            for _, future, _ in pending:
+                if future is not None:
+                    future.cancel()
@@ -0,0 +1,180 @@
+# Flat, serialisable records built from parsed Prefetch files, and
+# streaming CSV / JSON Lines writers for them. Records are plain dicts so
+# they can be pickled between processes and written one at a time.
+
+
+import csv
+import json
+from windowsprefetch.windowsprefetch import Prefetch
+from windowsprefetch.filetime import filetime_formatter
+
+
+# CSV header names and the record keys they are read from
+CSV_COLUMNS = (
+    ("Timestamp", "timestamp"),
+    ("Executable Name", "executable_name"),
+    ("MFT Seq Number", "mft_seq_number"),
+    ("MFT Entry Number", "mft_entry_number"),
+    ("Prefetch Hash", "hash"),
+    ("Run Count", "run_count"),
+)
+
+# CSV columns used when writing one row per file
+CSV_FILE_COLUMNS = (
+    ("Last Run", "last_run"),
+    ("Executable Name", "executable_name"),
+    ("MFT Seq Number", "mft_seq_number"),
+    ("MFT Entry Number", "mft_entry_number"),
+    ("Prefetch Hash", "hash"),
+    ("Run Count", "run_count"),
+    ("Version", "version"),
+    ("Timestamps", "timestamps"),
+    ("Source", "source"),
+)
+
+
+# Per-file record keys which are not copied into execution records
+DETAIL_KEYS = ("timestamps", "run_times", "last_run", "volumes", "directory_strings", "resources")
+
+
+def prefetch_record(p, time_format="default"):
+    """Return the flat per-file record for a parsed Prefetch object.
+
+    Run times are formatted according to time_format, one of the formats
+    accepted by windowsprefetch.filetime.filetime_formatter.
+    """
+    timestamps = list(map(filetime_formatter(time_format), p.runTimes))
+    return {
+        "source": p.pFileName,
+        "executable_name": p.executableName,
+        "hash": p.hash,
+        "version": p.version,
+        "run_count": p.runCount,
+        "mft_seq_number": getattr(p, "mftSeqNumber", None),
+        "mft_entry_number": getattr(p, "mftEntryNumber", None),
+        "last_run": timestamps[0] if timestamps else None,
+        "timestamps": timestamps,
+    }
+
+
+def full_record(p, time_format="default"):
+    """Return the per-file record extended with the variable-length sections.
+
+    Adds the volumes, each volume's directory strings and the loaded
+    resources with their NTFS file references (None for format version 17).
+    run_times and each volume's creation_time hold the raw FILETIMEs, which
+    sort chronologically whatever time_format is.
+    """
+    record = prefetch_record(p, time_format)
+    formatTime = filetime_formatter(time_format)
+    record["run_times"] = list(p.runTimes)
+    record["volumes"] = [{
+        "name": volume["Volume Name"].decode("UTF-16", errors="backslashreplace"),
+        "creation_time": volume["Creation Time"],
+        "creation_date": formatTime(volume["Creation Time"]),
+        "serial_number": volume["Serial Number"],
+    } for volume in p.volumesInformationArray]
+    record["directory_strings"] = [[path.rstrip("\x00") for path in volume]
+                                   for volume in p.directoryStringsArray]
+    record["resources"] = [{
+        "path": path,
+        "mft_entry_number": entry,
+        "mft_seq_number": sequence,
+    } for path, entry, sequence in p.metrics.resourceReferences(p.resources)]
+    return record
+
+
+def timeline_record(p, time_format="default"):
+    """Return the per-file record with the raw FILETIME run times added.
+
+    run_times lines up with timestamps and is what timelines are sorted by,
+    since formatted times do not always sort in time order.
+    """
+    record = prefetch_record(p, time_format)
+    record["run_times"] = list(p.runTimes)
+    return record
+
+
+def execution_records(record):
+    """Yield one record per run time held in a per-file record."""
+    for timestamp in record["timestamps"]:
+        execution = {"timestamp": timestamp}
+        for key, value in record.items():
+            if key not in DETAIL_KEYS:
+                execution[key] = value
+        yield execution
+
+
+def iter_prefetch(paths, per_execution=False, on_error=None, parser=Prefetch,
+                  stats=None, time_format="default", strings=None,
+                  make_record=prefetch_record):
+    """Parse each path in turn and yield its record(s).
+
+    One record is yielded per file, or one per run time when per_execution
+    is set. When on_error is given it is called with (path, exception) for
+    files that fail to parse and iteration continues; otherwise the
+    exception propagates. stats and strings (a shared StringTable) are
+    passed on to the parser, and make_record builds each file's record;
+    pass full_record to include the volumes and resources.
+    """
+    options = {}
+    if stats is not None:
+        options["stats"] = stats
+    if strings is not None:
+        options["strings"] = strings
+
+    for path in paths:
+        try:
+            p = parser(path, **options)
+            record = make_record(p, time_format)
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(path, e)
+            continue
+
+        if per_execution:
+            for execution in execution_records(record):
+                yield execution
+        else:
+            yield record
+
+
+class CsvWriter(object):
+    """Writes records as CSV rows, one row per call to write()."""
+
+    def __init__(self, fh, columns=CSV_COLUMNS, header=True):
+        self.keys = [key for _, key in columns]
+        self.writer = csv.writer(fh, lineterminator="\n")
+        if header:
+            self.writer.writerow([name for name, _ in columns])
+
+    def write(self, record):
+        row = []
+        for key in self.keys:
+            value = record.get(key)
+            if value is None:
+                value = "N/A"
+            elif isinstance(value, list):
+                value = "|".join(str(v) for v in value)
+            row.append(value)
+        self.writer.writerow(row)
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+
+class JsonLinesWriter(object):
+    """Writes records as JSON Lines, one object per line."""
+
+    def __init__(self, fh):
+        self.fh = fh
+
+    def write(self, record):
+        self.fh.write(json.dumps(record))
+        self.fh.write("\n")
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
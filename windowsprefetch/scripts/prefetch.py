@@ -1,63 +1,457 @@
 import os
 import sys
+import queue
+from collections import deque
 from argparse import ArgumentParser
-from windowsprefetch import Prefetch
+from multiprocessing import Pool
+from windowsprefetch.database import SqliteExporter
+from windowsprefetch.cache import ParseCache, CACHE_ENV, DEFAULT_MAX_BYTES
+from windowsprefetch.discovery import iter_prefetch_files, iter_archive_members, is_archive
+from windowsprefetch.stats import ParseStats
+from windowsprefetch.tasks import parseFile, parseChunk, cacheVariantFor
+from windowsprefetch.readahead import iter_readahead, DEFAULT_DEPTH, DEFAULT_THREADS
+from windowsprefetch.readahead import DEFAULT_MAX_BYTES as READAHEAD_MAX_BYTES
+from windowsprefetch.watch import watch, DEFAULT_INTERVAL
+from windowsprefetch.index import PathIndex, MATCH_MODES, QUERY_COLUMNS, KIND_RESOURCE, KIND_DIRECTORY
+from windowsprefetch.timeline import Timeline, host_from_path, TIMELINE_COLUMNS, DEFAULT_MAX_ROWS
+from windowsprefetch.records import (execution_records, CsvWriter,
+    JsonLinesWriter, CSV_COLUMNS, CSV_FILE_COLUMNS)
 
 
-# Note: This wrapper script is a work in progress, and needs to be refined.
-# todo: robust error handling and notifications, built into result output.
-# todo: error-handling based on file content, not just file extension
+# Files sent to a worker process at a time, and chunks in flight per
+# worker, when parsing with --jobs
+CHUNK_FILES = 16
+CHUNKS_PER_JOB = 4
+
+
+def parseAll(candidates, variant, cache, jobs, unordered, stats=None, timeFormat="default", readahead=None):
+    # Yields (path, payload, error) for every candidate. Unchanged files are
+    # served from the cache; the rest are parsed, in a process pool when
+    # jobs > 1, and written back to the cache. Parse timings are merged
+    # into stats when it is given. readahead, a dict of iter_readahead
+    # options, selects the read-ahead pipeline for a single parser.
+    # Candidates are consumed as results are written, never collected
+    # first, so output starts at once and memory use is bounded
+    cacheVariant = cacheVariantFor(variant, timeFormat)
+    if readahead is not None:
+        for result in parseReadAhead(candidates, variant, cacheVariant, cache, stats, timeFormat, readahead):
+            yield result
+        return
+
+    def lookups():
+        # Cache lookups are made as candidates arrive, so that neither the
+        # discovery walk nor archive members are held in memory at once
+        for candidate in candidates:
+            payload = None
+            if cache is not None:
+                payload = cache.get(candidate.path, candidate.size, candidate.mtime, cacheVariant)
+            if payload is not None and stats is not None:
+                stats.count("cacheHits")
+            yield candidate, payload
+
+    def task(candidate):
+        return (candidate.path, getattr(candidate, "data", None), variant, timeFormat,
+                cache is not None, stats is not None)
+
+    def store(candidate, result):
+        filepath, payload, error, cacheInfo, totals = result
+        if totals is not None:
+            stats.merge(totals)
+        if cache is not None and error is None:
+            cache.put(filepath, candidate.size, candidate.mtime, cacheVariant, payload, *cacheInfo)
+        return filepath, payload, error
+
+    if jobs == 1:
+        for candidate, payload in lookups():
+            if payload is not None:
+                yield candidate.path, payload, None
+            else:
+                yield store(candidate, parseFile(task(candidate)))
+        return
+
+    # Files go to the workers CHUNK_FILES at a time, with at most
+    # CHUNKS_PER_JOB chunks per worker waiting to be parsed or written, so
+    # memory use does not grow with the number of candidates. The pool is
+    # only started once a whole chunk needs parsing
+    maxPending = jobs * CHUNKS_PER_JOB
+    pool = None
+    try:
+        if unordered:
+            done = queue.Queue()
+            outstanding = 0
+            chunk = []
+
+            def collect():
+                chunk, results, error = done.get()
+                if error is not None:
+                    raise error
+                return zip(chunk, results)
+
+            for candidate, payload in lookups():
+                if payload is not None:
+                    yield candidate.path, payload, None
+                    continue
+                chunk.append(candidate)
+                if len(chunk) < CHUNK_FILES:
+                    continue
+                if pool is None:
+                    pool = Pool(jobs)
+                pool.apply_async(parseChunk, ([task(c) for c in chunk],),
+                                 callback=lambda results, chunk=chunk: done.put((chunk, results, None)),
+                                 error_callback=lambda e, chunk=chunk: done.put((chunk, None, e)))
+                chunk = []
+                outstanding += 1
+                while outstanding >= maxPending:
+                    for c, result in collect():
+                        yield store(c, result)
+                    outstanding -= 1
+            for c in chunk:
+                yield store(c, parseFile(task(c)))
+            while outstanding:
+                for c, result in collect():
+                    yield store(c, result)
+                outstanding -= 1
+        else:
+            # Chunks hold candidates in input order, cache hits included,
+            # and are written out whole once their files are parsed
+            pending = deque()
+            chunk = []
+
+            def submit(chunk, last=False):
+                # Returns (chunk, AsyncResult), or (chunk, None) for a chunk
+                # to parse here: one with no misses, or a last partial one
+                # when no pool was needed
+                nonlocal pool
+                tasks = [task(c) for c, payload in chunk if payload is None]
+                if not tasks or (last and pool is None):
+                    return chunk, None
+                if pool is None:
+                    pool = Pool(jobs)
+                return chunk, pool.apply_async(parseChunk, (tasks,))
+
+            def drain(chunk, results):
+                if results is None:
+                    parsed = (parseFile(task(c)) for c, payload in chunk if payload is None)
+                else:
+                    parsed = iter(results.get())
+                for candidate, payload in chunk:
+                    if payload is not None:
+                        yield candidate.path, payload, None
+                    else:
+                        yield store(candidate, next(parsed))
+
+            for candidate, payload in lookups():
+                if payload is not None and not chunk and not pending:
+                    yield candidate.path, payload, None
+                    continue
+                chunk.append((candidate, payload))
+                if len(chunk) < CHUNK_FILES:
+                    continue
+                pending.append(submit(chunk))
+                chunk = []
+                while len(pending) >= maxPending:
+                    for result in drain(*pending.popleft()):
+                        yield result
+            if chunk:
+                pending.append(submit(chunk, True))
+            while pending:
+                for result in drain(*pending.popleft()):
+                    yield result
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def parseReadAhead(candidates, variant, cacheVariant, cache, stats, timeFormat, options):
+    # Parses one file at a time while threads read the following files
+    # into memory. Candidates are consumed as the read-ahead window moves,
+    # so memory use is bounded by its limits rather than the collection
+    def lookups():
+        for candidate in candidates:
+            payload = None
+            if cache is not None:
+                payload = cache.get(candidate.path, candidate.size, candidate.mtime, cacheVariant)
+            yield candidate, payload
+
+    def source(lookup):
+        candidate, payload = lookup
+        if payload is not None or getattr(candidate, "data", None) is not None:
+            return None
+        return candidate.path, candidate.size
+
+    for (candidate, payload), data in iter_readahead(lookups(), source, stats=stats, **options):
+        if payload is not None:
+            if stats is not None:
+                stats.count("cacheHits")
+            yield candidate.path, payload, None
+            continue
+
+        if data is None:
+            data = getattr(candidate, "data", None)
+        filepath, payload, error, cacheInfo, totals = parseFile(
+            (candidate.path, data, variant, timeFormat, cache is not None, stats is not None))
+        if totals is not None:
+            stats.merge(totals)
+        if cache is not None and error is None:
+            cache.put(filepath, candidate.size, candidate.mtime, cacheVariant, payload, *cacheInfo)
+        yield filepath, payload, error
+
+
+def writeResult(writer, filepath, payload, per_execution):
+    if writer is None:
+        print(payload)
+        return
+    # Cached records may have been stored under another path
+    payload["source"] = filepath
+    if per_execution:
+        writer.write_all(execution_records(payload))
+    else:
+        writer.write(payload)
+
+
+def queryIndex(args):
+    # Answers --query from the index alone, without parsing anything
+    with PathIndex(args.index) as index:
+        results = index.query(args.query, args.match, args.kind)
+    writer = JsonLinesWriter(sys.stdout) if args.jsonl else CsvWriter(sys.stdout, QUERY_COLUMNS)
+    writer.write_all(results)
+
+
+def watchFile(args, skipped):
+    # Writes each new execution as a JSON Lines record as soon as a poll
+    # finds it, until interrupted
+    def failed(path, e):
+        sys.stderr.write("[ - ] {}: {}: {}\n".format(path, type(e).__name__, e))
+
+    writer = JsonLinesWriter(sys.stdout)
+    events = watch(args.file, args.watch, include=args.include, exclude=args.exclude,
+                   max_depth=args.max_depth, time_format=args.time_format,
+                   on_skip=skipped, on_error=failed)
+    try:
+        for execution in events:
+            writer.write(execution)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+def serveRequests(args):
+    # Answers parse requests until stdin is exhausted, or on --socket until
+    # interrupted. The service is imported here so that one-shot runs do
+    # not pay for its imports
+    from windowsprefetch.service import PrefetchService, serve_socket
+
+    cache = None
+    if args.cache and not args.no_cache:
+        cache = ParseCache(args.cache, args.cache_size * 1024 * 1024, args.cache_verify,
+                           check_same_thread=False)
+    service = PrefetchService(args.jobs, cache, "quick" if args.quick else "record", args.time_format)
+    try:
+        if args.socket:
+            serve_socket(service, args.socket)
+        else:
+            service.serve(sys.stdin, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        if cache is not None:
+            cache.close()
 
 
 def main():
     p = ArgumentParser()
     p.add_argument("-c", "--csv", help="Present results in CSV format", action="store_true")
-    p.add_argument("-f", "--file", help="Parse a given Prefetch file", required=True)
+    p.add_argument("-J", "--jsonl", help="Present results as JSON Lines", action="store_true")
+    p.add_argument("--sqlite", help="Write results to normalised tables in this SQLite database", metavar="OUT.db")
+    p.add_argument("--quick", help="With --csv or --jsonl, read only the header and file information of each file, for fast triage", action="store_true")
+    p.add_argument("--timeline", help="Write every execution from every file as one chronologically sorted timeline with host and source columns, as CSV (or JSON Lines with --jsonl)", action="store_true")
+    p.add_argument("--timeline-rows", help="Executions to sort in memory before spilling sorted runs to temporary files (default: {})".format(DEFAULT_MAX_ROWS), type=int, metavar="N", default=DEFAULT_MAX_ROWS)
+    p.add_argument("--per-file", help="With --csv or --jsonl, write one record per file instead of one per execution", action="store_true")
+    p.add_argument("--index", help="Add the paths each file references to this inverted index, skipping files already indexed unchanged; or, with --query, search it", metavar="INDEX.db")
+    p.add_argument("--host", help="With --index or --timeline, record the files as coming from this host (default for --timeline: the first directory below --file)", metavar="NAME")
+    p.add_argument("--query", help="List the files in --index which reference paths matching PATTERN, as CSV (or JSON Lines with --jsonl)", metavar="PATTERN")
+    p.add_argument("--match", help="How --query matches paths: {} (default: exact)".format(", ".join(MATCH_MODES)), choices=MATCH_MODES, default="exact")
+    p.add_argument("--kind", help="Only match loaded resources or directory strings with --query", choices=(KIND_RESOURCE, KIND_DIRECTORY))
+    p.add_argument("-f", "--file", help="Parse a given Prefetch file, a directory of them, or a .zip or .tar(.gz) archive of them")
+    p.add_argument("--include", help="Only consider files matching this glob (may be repeated)", action="append", metavar="GLOB")
+    p.add_argument("--exclude", help="Skip files and directories matching this glob (may be repeated)", action="append", metavar="GLOB")
+    p.add_argument("--max-depth", help="How many directory levels below --file to search (default: unlimited)", type=int, metavar="N")
+    p.add_argument("-j", "--jobs", help="Number of parser processes to use (default: 1)", type=int, default=1)
+    p.add_argument("-u", "--unordered", help="With --jobs, print results as soon as they are ready instead of in directory order", action="store_true")
+    p.add_argument("--cache", help="Cache parse results in this SQLite file and reuse them for unchanged files (default: ${})".format(CACHE_ENV), metavar="PATH", default=os.environ.get(CACHE_ENV))
+    p.add_argument("--no-cache", help="Do not read or write the parse cache", action="store_true")
+    p.add_argument("--cache-size", help="Maximum cache size in MB before least recently used entries are evicted (default: {})".format(DEFAULT_MAX_BYTES // (1024 * 1024)), type=int, metavar="MB", default=DEFAULT_MAX_BYTES // (1024 * 1024))
+    p.add_argument("--cache-verify", help="Only use cache entries whose content digest still matches the file", action="store_true")
+    p.add_argument("--readahead", help="Read N files (default: {}) ahead of the parser on background threads, for slow storage".format(DEFAULT_DEPTH), type=int, metavar="N", nargs="?", const=DEFAULT_DEPTH, default=0)
+    p.add_argument("--readahead-threads", help="Number of read-ahead threads (default: {})".format(DEFAULT_THREADS), type=int, metavar="N", default=DEFAULT_THREADS)
+    p.add_argument("--readahead-memory", help="Most data to hold read ahead, in MB (default: {})".format(READAHEAD_MAX_BYTES // (1024 * 1024)), type=int, metavar="MB", default=READAHEAD_MAX_BYTES // (1024 * 1024))
+    p.add_argument("--time-format", help="How to write timestamps: default, iso (ISO 8601), epoch (Unix seconds) or a strftime format such as %%Y-%%m-%%d", metavar="FORMAT", default="default")
+    p.add_argument("--watch", help="Poll --file every SECONDS (default: {:g}) and write new executions as JSON Lines until interrupted".format(DEFAULT_INTERVAL), type=float, metavar="SECONDS", nargs="?", const=DEFAULT_INTERVAL)
+    p.add_argument("--serve", help="Run as a service: answer parse requests (paths, or JSON objects) read from stdin with JSON Lines records on stdout, keeping --jobs workers and --cache warm between them", action="store_true")
+    p.add_argument("--socket", help="With --serve, answer requests on connections to this Unix socket instead of stdin", metavar="PATH")
+    p.add_argument("--stats", help="Print per-phase parse timings and counters to stderr when done, as a table or as JSON", nargs="?", const="table", choices=("table", "json"))
     args = p.parse_args()
 
+    if args.query is not None:
+        if args.file is not None or not args.index:
+            p.error("--query searches an existing --index and does not take --file")
+        if not os.path.exists(args.index):
+            p.error("no index at {}".format(args.index))
+        queryIndex(args)
+        return
+
+    if args.socket and not args.serve:
+        p.error("--socket is only used with --serve")
+    if args.serve:
+        if args.jobs < 1:
+            p.error("--jobs must be at least 1")
+        if (args.file or args.csv or args.sqlite or args.index or args.timeline or args.per_file
+                or args.watch is not None or args.readahead or args.stats):
+            p.error("--serve reads its requests and writes JSON Lines, and cannot be combined with --file, --csv, --sqlite, --index, --timeline, --per-file, --watch, --readahead or --stats")
+        serveRequests(args)
+        return
+
+    if args.file is None:
+        p.error("the following arguments are required: -f/--file")
+    if args.jobs < 1:
+        p.error("--jobs must be at least 1")
+    if sum(1 for mode in (args.csv, args.jsonl, args.sqlite, args.index) if mode) > 1:
+        p.error("--csv, --jsonl, --sqlite and --index are mutually exclusive")
+    if args.max_depth is not None and args.max_depth < 0:
+        p.error("--max-depth cannot be negative")
+    if args.readahead < 0 or args.readahead_threads < 1 or args.readahead_memory < 1:
+        p.error("--readahead cannot be negative, --readahead-threads and --readahead-memory must be at least 1")
+    if args.timeline and (args.sqlite or args.index or args.per_file or args.watch is not None):
+        p.error("--timeline cannot be combined with --sqlite, --index, --per-file or --watch")
+    if args.timeline_rows < 1:
+        p.error("--timeline-rows must be at least 1")
+    if args.quick and not (args.csv or args.jsonl or args.timeline):
+        p.error("--quick only reads what --csv and --jsonl write; use it with one of them")
+    if args.readahead and args.jobs > 1:
+        p.error("--readahead is for a single parser; with --jobs every process reads its own files")
+    if args.watch is not None:
+        if args.watch <= 0:
+            p.error("--watch needs a positive interval")
+        if args.csv or args.sqlite or args.index or args.per_file or args.jobs > 1 or args.readahead or args.stats:
+            p.error("--watch writes JSON Lines and cannot be combined with --csv, --sqlite, --index, --per-file, --jobs, --readahead or --stats")
+        if is_archive(args.file):
+            p.error("--watch needs a directory or file, not an archive")
+
+
+    def skipped(path, reason):
+        sys.stderr.write("[ ! ] Skipping {}: {}\n".format(path, reason))
+
+    if args.watch is not None:
+        watchFile(args, skipped)
+        return
+
+    if is_archive(args.file):
+        candidates = iter_archive_members(args.file, args.include, args.exclude, on_skip=skipped)
+    else:
+        candidates = iter_prefetch_files(args.file, args.include, args.exclude,
+                                         args.max_depth, on_skip=skipped)
+
+    variant = "quick" if args.quick else "record"
+    per_execution = not args.per_file
+    writer = None
+    timeline = None
+    if args.timeline:
+        variant = "timeline"
+        writer = JsonLinesWriter(sys.stdout) if args.jsonl else CsvWriter(sys.stdout, TIMELINE_COLUMNS)
+        timeline = Timeline(args.timeline_rows)
+    elif args.csv:
+        writer = CsvWriter(sys.stdout, CSV_COLUMNS if per_execution else CSV_FILE_COLUMNS)
+    elif args.jsonl:
+        writer = JsonLinesWriter(sys.stdout)
+    elif args.sqlite:
+        variant = "full"
+        per_execution = False
+        try:
+            writer = SqliteExporter(args.sqlite)
+        except ValueError as e:
+            p.error(str(e))
+    elif args.index:
+        variant = "full"
+        writer = PathIndex(args.index)
+    else:
+        variant = "pretty"
 
-    file_paths = []
-    if os.path.isdir(args.file):
-        for filename in os.listdir(args.file):
-            file_paths.append(os.path.join(args.file, filename))
+    if args.index:
+        # Files are indexed under their source, size and mtime, so only new
+        # and changed ones are parsed
+        stamps = {}
+
+        def unindexed(candidates):
+            for c in candidates:
+                if not writer.is_current(c.path, c.size, c.mtime):
+                    stamps[c.path] = (c.size, c.mtime)
+                    yield c
+        candidates = unindexed(candidates)
+
+        def write(filepath, payload):
+            payload["source"] = filepath
+            size, mtime = stamps.pop(filepath)
+            writer.add(payload, size, mtime, args.host)
+    elif timeline is not None:
+        # Executions are collected, and only written once every file is in
+        def write(filepath, payload):
+            payload["source"] = filepath
+            host = args.host if args.host is not None else host_from_path(args.file, filepath)
+            timeline.add(payload, host)
     else:
-        file_paths.append(args.file)
-
-
-    parsed_files = []
-    for filepath in file_paths:
-        if filepath.endswith(".pf"):
-            if os.path.getsize(filepath) > 0:
-                p = Prefetch(filepath)
-                parsed_files.append(p)
-
-    if args.csv:
-        print("Timestamp,Executable Name,MFT Seq Number,MFT Entry Number,Prefetch Hash,Run Count")
-
-    for p in parsed_files:
-        if args.csv:
-            if p.version > 17:
-                for timestamp in p.timestamps:
-                    print("{},{},{},{},{},{}".format(
-                        timestamp,
-                        p.executableName,
-                        p.hash,                        
-                        p.mftSeqNumber,
-                        p.mftEntryNumber,
-                        p.runCount
-                    ))
+        def write(filepath, payload):
+            writeResult(writer, filepath, payload, per_execution)
+
+    cache = None
+    if args.cache and not args.no_cache:
+        cache = ParseCache(args.cache, args.cache_size * 1024 * 1024, args.cache_verify)
+
+    stats = ParseStats() if args.stats else None
+    readahead = None
+    if args.readahead:
+        readahead = {
+            "depth": args.readahead,
+            "threads": args.readahead_threads,
+            "max_bytes": args.readahead_memory * 1024 * 1024,
+        }
+    output = stats.phase("output") if stats is not None else None
+
+    failures = 0
+    try:
+        for filepath, payload, error in parseAll(candidates, variant, cache, args.jobs, args.unordered, stats, args.time_format, readahead):
+            if error is not None:
+                failures += 1
+                sys.stderr.write("[ - ] {}: {}\n".format(filepath, error))
+            elif output is None:
+                write(filepath, payload)
+            else:
+                with output:
+                    write(filepath, payload)
+
+        if timeline is not None:
+            if output is None:
+                writer.write_all(timeline)
             else:
-                for timestamp in p.timestamps:
-                    print("{},{},{},{},{},{}".format(
-                        timestamp,
-                        p.executableName,
-                        p.hash,
-                        "N/A",
-                        "N/A",
-                        p.runCount
-                    ))
+                with output:
+                    writer.write_all(timeline)
+    finally:
+        if timeline is not None:
+            timeline.close()
+        if cache is not None:
+            cache.close()
+        if args.sqlite or args.index:
+            writer.close()
+
+    if stats is not None:
+        if args.stats == "json":
+            sys.stderr.write(stats.to_json() + "\n")
         else:
-            p.prettyPrint()
+            sys.stderr.write(stats.format_table() + "\n")
+
+    if failures:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,284 @@
+# Long-running parser service. Tooling which would otherwise start
+# prefetch.py once per file, paying for interpreter startup, imports and a
+# new process pool every time, sends its requests to one process instead,
+# which keeps its worker processes and parse cache warm between them.
+#
+# Requests are read one per line, from stdin or from connections to a Unix
+# socket. A line is either a path, or a JSON object
+#
+#   {"id": 1, "path": "C:/cases/host1/CMD.EXE-4A81B364.pf"}
+#   {"id": 2, "name": "CMD.EXE-4A81B364.pf", "data": "<base64>"}
+#
+# optionally with "variant" (one of VARIANTS) and "time_format" keys
+# overriding the service's defaults. Every request gets one JSON line back,
+# in request order, with its id if it had one:
+#
+#   {"id": 1, "source": "...", "record": {...}}
+#   {"id": 2, "source": "...", "error": "ValueError: ..."}
+#
+# Requests are read ahead of the responses being written, so with several
+# workers the files of one stream are parsed in parallel.
+
+
+import io
+import os
+import json
+import stat
+import queue
+import base64
+import signal
+import threading
+import socketserver
+from multiprocessing import Pool
+
+from windowsprefetch.tasks import parseFile, cacheVariantFor
+
+
+# Requests read ahead of the responses written, per stream
+DEFAULT_DEPTH = 64
+
+# Payloads a request can ask for; see tasks.PAYLOADS
+VARIANTS = ("record", "quick", "full", "pretty")
+
+
+def ignoreInterrupt():
+    # Worker processes leave Ctrl-C to the service, which shuts them down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Ready(object):
+    # A response known as soon as its request is read, with the get() of
+    # multiprocessing's AsyncResult
+    __slots__ = ("response",)
+
+    def __init__(self, response):
+        self.response = response
+
+    def get(self):
+        return self.response
+
+
+class Pending(object):
+    # A response waiting on a worker process
+    __slots__ = ("service", "response", "stamp", "cacheVariant", "result")
+
+    def __init__(self, service, response, stamp, cacheVariant, result):
+        self.service = service
+        self.response = response
+        self.stamp = stamp
+        self.cacheVariant = cacheVariant
+        self.result = result
+
+    def get(self):
+        return self.service.finish(self.response, self.stamp, self.cacheVariant, self.result.get())
+
+
+class PrefetchService(object):
+    """Answers parse requests with warm worker processes and caches.
+
+    With jobs > 1 a pool of that many worker processes is started once and
+    kept for the life of the service. cache, a ParseCache opened with
+    check_same_thread=False, answers path requests for unchanged files and
+    is filled with the rest; it is committed whenever a stream runs out of
+    requests to answer. variant and time_format are used for requests which
+    do not name their own. close() stops the workers but leaves the cache
+    open.
+    """
+
+    def __init__(self, jobs=1, cache=None, variant="record", time_format="default",
+                 depth=DEFAULT_DEPTH):
+        if jobs < 1 or depth < 1:
+            raise ValueError("jobs and depth must be at least 1")
+        if variant not in VARIANTS:
+            raise ValueError("Unknown variant {!r}".format(variant))
+        self.pool = Pool(jobs, ignoreInterrupt) if jobs > 1 else None
+        self.cache = cache
+        self.variant = variant
+        self.time_format = time_format
+        self.depth = depth
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, line):
+        """Start answering one request line.
+
+        Returns an object whose get() waits for and returns the response.
+        """
+        try:
+            request = json.loads(line) if line.startswith("{") else {"path": line}
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            return Ready({"error": "Bad request: {}".format(e)})
+
+        response = {}
+        if "id" in request:
+            response["id"] = request["id"]
+        variant = request.get("variant", self.variant)
+        timeFormat = request.get("time_format", self.time_format)
+        if not isinstance(variant, str) or variant not in VARIANTS:
+            response["error"] = "Bad request: unknown variant {!r}".format(variant)
+            return Ready(response)
+        if not isinstance(timeFormat, str):
+            response["error"] = "Bad request: time_format must be a string"
+            return Ready(response)
+
+        stamp = None
+        if "data" in request:
+            path = request.get("name", "<data>")
+            if not isinstance(path, str):
+                response["error"] = "Bad request: name must be a string"
+                return Ready(response)
+            response["source"] = path
+            try:
+                data = base64.b64decode(request["data"], validate=True)
+            except (TypeError, ValueError) as e:
+                response["error"] = "Bad request: {}".format(e)
+                return Ready(response)
+        elif "path" in request:
+            path = request["path"]
+            # Anything but a string, a file descriptor above all, would be
+            # opened as something other than a file name
+            if not isinstance(path, str):
+                response["error"] = "Bad request: path must be a string"
+                return Ready(response)
+            response["source"] = path
+            data = None
+            try:
+                st = os.stat(path)
+            except (ValueError, OSError) as e:
+                response["error"] = "{}: {}".format(type(e).__name__, e)
+                return Ready(response)
+            stamp = (st.st_size, st.st_mtime_ns)
+        else:
+            response["error"] = "Bad request: expected a path or data"
+            return Ready(response)
+
+        # Only files on disk are cached; buffers have no stat values to key on
+        cached = self.cache is not None and stamp is not None
+        cacheVariant = cacheVariantFor(variant, timeFormat)
+        if cached:
+            with self.lock:
+                payload = self.cache.get(path, stamp[0], stamp[1], cacheVariant)
+            if payload is not None:
+                response["record"] = payload
+                return Ready(response)
+
+        task = (path, data, variant, timeFormat, cached, False)
+        if self.pool is None:
+            return Ready(self.finish(response, stamp, cacheVariant, parseFile(task)))
+        return Pending(self, response, stamp, cacheVariant, self.pool.apply_async(parseFile, (task,)))
+
+    def finish(self, response, stamp, cacheVariant, result):
+        # Completes a response from what parseFile returned, caching the
+        # payload when it was asked to
+        filepath, payload, error, cacheInfo, _ = result
+        if error is not None:
+            response["error"] = error
+            return response
+        response["record"] = payload
+        if cacheInfo is not None:
+            with self.lock:
+                self.cache.put(filepath, stamp[0], stamp[1], cacheVariant, payload, *cacheInfo)
+        return response
+
+    def serve(self, infile, outfile):
+        """Answer the requests read from infile on outfile until EOF.
+
+        outfile is flushed whenever no more responses are queued, so a
+        client sending one request at a time gets each answer at once.
+        Returns when infile is exhausted, or early if outfile is closed by
+        the other end.
+        """
+        responses = queue.Queue(self.depth)
+        stopped = threading.Event()
+
+        def put(item):
+            # Gives up once the writer has stopped, rather than blocking on
+            # a queue no one reads any more
+            while not stopped.is_set():
+                try:
+                    responses.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read():
+            try:
+                for line in infile:
+                    line = line.strip()
+                    if line and not put(self.submit(line)):
+                        return
+            finally:
+                put(None)
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+        try:
+            while True:
+                pending = responses.get()
+                if pending is None:
+                    break
+                outfile.write(json.dumps(pending.get()) + "\n")
+                if responses.empty():
+                    outfile.flush()
+                    self.flush()
+            outfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            stopped.set()
+
+    def flush(self):
+        """Commit what has been added to the cache."""
+        if self.cache is not None:
+            with self.lock:
+                self.cache.flush()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+class ServiceHandler(socketserver.StreamRequestHandler):
+    # Serves one connection as a request stream
+
+    def handle(self):
+        infile = io.TextIOWrapper(self.rfile, encoding="utf-8")
+        outfile = io.TextIOWrapper(self.wfile, encoding="utf-8")
+        self.server.service.serve(infile, outfile)
+
+
+def serve_socket(service, path):
+    """Serve requests on a Unix socket at path until interrupted.
+
+    Every connection is a request stream of its own, handled on its own
+    thread, and all of them share the service's workers and cache. A stale
+    socket left at path is replaced.
+    """
+    if not hasattr(socketserver, "UnixStreamServer"):
+        raise OSError("Unix domain sockets are not available on this platform")
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+    server = Server(path, ServiceHandler)
+    server.service = service
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
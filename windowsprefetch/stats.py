@@ -0,0 +1,130 @@
+# Optional instrumentation for the parser: wall time per parsing phase and
+# counters for bytes read, read calls, compressed and plain files and
+# failures.
+#
+# Parsers take a stats object and report to it through two calls,
+# phase(name), a context manager timing one phase, and count(name, n).
+# NULL_STATS, the default, ignores both, so an uninstrumented parse only
+# pays for a handful of no-op calls per file.
+#
+# Phases reported by Prefetch and LazyPrefetch:
+#
+#   read              reading the file
+#   decompress        MAM decompression
+#   header            header, file information and the first metrics entry
+#   timestamps        decoding the last run times
+#   metrics           the file metrics array
+#   traceChains       slicing out the trace chains array
+#   volumes           the volume information array, including directory strings
+#   directoryStrings  the directory strings of one volume
+#   filenames         the filename strings
+
+
+import json
+import time
+
+
+class NullPhase(object):
+    # Context manager which does nothing, shared by every NullStats phase
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class NullStats(object):
+    """Stats sink which records nothing."""
+
+    __slots__ = ()
+
+    def phase(self, name):
+        return NULL_PHASE
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+class PhaseTimer(object):
+    # Context manager adding the time spent in its block to a ParseStats
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class ParseStats(object):
+    """Accumulates phase times and counters over any number of parses.
+
+    When callback is given it is called as callback(name, value) for every
+    measurement as it is made, with the elapsed seconds for a phase or the
+    increment for a counter, so the numbers can be forwarded elsewhere.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+
+    def phase(self, name):
+        return PhaseTimer(self, name)
+
+    def add_time(self, name, seconds, calls=1):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+        if self.callback is not None:
+            self.callback(name, seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.callback is not None:
+            self.callback(name, n)
+
+    def as_dict(self):
+        """Return the totals as a JSON-serialisable dict."""
+        phases = {}
+        for name, seconds in self.seconds.items():
+            phases[name] = {"seconds": seconds, "calls": self.calls[name]}
+        return {"phases": phases, "counters": dict(self.counters)}
+
+    def merge(self, totals):
+        """Add totals from another ParseStats' as_dict(), e.g. from a worker."""
+        for name, phase in totals["phases"].items():
+            self.add_time(name, phase["seconds"], phase["calls"])
+        for name, n in totals["counters"].items():
+            self.count(name, n)
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+    def format_table(self):
+        """Return the totals as a plain text table, slowest phase first."""
+        lines = ["{:<18} {:>9} {:>10} {:>10}".format("Phase", "Calls", "Seconds", "ms/call")]
+        for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            seconds, calls = self.seconds[name], self.calls[name]
+            lines.append("{:<18} {:>9} {:>10.3f} {:>10.3f}".format(
+                name, calls, seconds, seconds * 1000.0 / calls if calls else 0.0))
+        if self.counters:
+            lines.append("")
+            lines.append("{:<18} {:>9}".format("Counter", "Value"))
+            for name in sorted(self.counters):
+                lines.append("{:<18} {:>9}".format(name, self.counters[name]))
+        return "\n".join(lines)
@@ -0,0 +1,51 @@
+# Shared string table for parsing many prefetch files. Files from one fleet
+# load mostly the same resources from mostly the same directories, so when
+# a StringTable is passed to the parser every distinct path is decoded and
+# stored once, and each parsed file refers to it by a small integer ID.
+
+
+from array import array
+
+
+class StringTable(object):
+    """Interned strings, each identified by its index in the table.
+
+    Strings are looked up by their text, or by their raw UTF-16 bytes so
+    that a repeated directory string is not decoded again. Both kinds of
+    key share one dict, as bytes never compare equal to str.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, stringId):
+        return self.strings[stringId]
+
+    def intern(self, text):
+        """Return the ID of text, adding it to the table if needed."""
+        stringId = self.ids.get(text)
+        if stringId is None:
+            stringId = self.ids[text] = len(self.strings)
+            self.strings.append(text)
+        return stringId
+
+    def intern_utf16(self, raw):
+        """Return the ID of the string encoded as raw UTF-16 bytes."""
+        raw = bytes(raw)
+        stringId = self.ids.get(raw)
+        if stringId is None:
+            stringId = self.ids[raw] = self.intern(str(raw, "UTF-16", "backslashreplace"))
+        return stringId
+
+    def intern_all(self, texts):
+        """Intern each string in texts and return their IDs as an array."""
+        return array("I", map(self.intern, texts))
+
+    def lookup(self, ids):
+        """Return the strings for a sequence of IDs."""
+        strings = self.strings
+        return [strings[stringId] for stringId in ids]
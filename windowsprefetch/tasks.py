@@ -0,0 +1,87 @@
+# Parsing one file into the payload asked for, as the command line tool and
+# the parser service both do, in their own process or in a worker process.
+# Tasks and results are plain tuples so they can be pickled between
+# processes.
+
+
+from windowsprefetch.windowsprefetch import Prefetch, LazyPrefetch
+from windowsprefetch.cache import content_digest
+from windowsprefetch.stats import ParseStats
+from windowsprefetch.records import prefetch_record, full_record, timeline_record
+
+
+# What parseFile returns for each output variant, given the time format
+PAYLOADS = {
+    "pretty": lambda p, timeFormat: p.prettyFormat(timeFormat),
+    "record": prefetch_record,
+    "quick": prefetch_record,
+    "timeline": timeline_record,
+    "full": full_record,
+}
+
+# Variants built from the summary alone, which are parsed in quick mode
+QUICK_VARIANTS = ("quick", "timeline")
+
+
+def readData(path, stats):
+    # Reads a whole file, counted as the parser's own reads are
+    if stats is None:
+        with open(path, "rb") as f:
+            return f.read()
+    with stats.phase("read"):
+        with open(path, "rb") as f:
+            data = f.read()
+    stats.count("reads")
+    stats.count("bytesRead", len(data))
+    return data
+
+
+def parseFile(task):
+    # Parses one file and returns (path, payload, error, cacheInfo, stats).
+    # The payload is the pretty-printed text, the per-file record or the
+    # full record, depending on the variant; only that travels back from
+    # worker processes, never the Prefetch object. cacheInfo is (content
+    # digest, prefetch hash) when the result is to be cached, and stats the
+    # file's ParseStats totals when they were asked for. data holds the
+    # contents of archive members, and is None for files on disk. The
+    # quick variants only read the summary of each file, unless the whole
+    # file is needed for its digest
+    filepath, data, variant, timeFormat, cached, timed = task
+    stats = ParseStats() if timed else None
+    try:
+        if cached and data is None:
+            # The file is read once, for both the parser and the digest
+            data = readData(filepath, stats)
+        if variant in QUICK_VARIANTS:
+            if data is None:
+                p = LazyPrefetch(filepath, stats=stats, quick=True)
+            else:
+                p = LazyPrefetch.from_bytes(data, filepath, stats=stats, quick=True)
+        elif data is None:
+            p = Prefetch(filepath, stats=stats)
+        else:
+            p = Prefetch.from_bytes(data, filepath, stats=stats)
+        if stats is None:
+            payload = PAYLOADS[variant](p, timeFormat)
+        else:
+            with stats.phase("format"):
+                payload = PAYLOADS[variant](p, timeFormat)
+        cacheInfo = None
+        if cached:
+            cacheInfo = (content_digest(data), p.hash)
+        error = None
+    except Exception as e:
+        payload, cacheInfo = None, None
+        error = "{}: {}".format(type(e).__name__, e)
+    return filepath, payload, error, cacheInfo, None if stats is None else stats.as_dict()
+
+
+def parseChunk(tasks):
+    # Parses a chunk of files in a worker process
+    return [parseFile(task) for task in tasks]
+
+
+def cacheVariantFor(variant, timeFormat):
+    # Names what is cached for a file: results formatted differently are
+    # kept apart
+    return variant if timeFormat == "default" else "{}:{}".format(variant, timeFormat)
@@ -0,0 +1,125 @@
+# One chronological execution timeline across any number of files and
+# hosts, built as an external merge sort. Each file's run times are sorted
+# as it is added; once more than max_rows executions are held they are
+# sorted (cheaply, as they are already sorted runs) and spilled to a
+# temporary file. Reading the timeline merges the spilled runs and what is
+# left in memory with a heap, so the whole timeline is never in memory.
+
+
+import os
+import heapq
+import pickle
+import tempfile
+from operator import itemgetter
+
+from windowsprefetch.records import execution_records
+
+
+# Executions held in memory before they are spilled to a temporary file
+DEFAULT_MAX_ROWS = 500000
+
+# CSV header names and the timeline row keys they are read from
+TIMELINE_COLUMNS = (
+    ("Timestamp", "timestamp"),
+    ("Host", "host"),
+    ("Executable Name", "executable_name"),
+    ("Prefetch Hash", "hash"),
+    ("Run Count", "run_count"),
+    ("MFT Seq Number", "mft_seq_number"),
+    ("MFT Entry Number", "mft_entry_number"),
+    ("Source", "source"),
+)
+
+byRunTime = itemgetter(0)
+
+
+def host_from_path(root, path):
+    """Return the host name for a file found under root.
+
+    Collections are usually laid out with one directory per host, so this
+    is the first directory below root in path (or in the member name, for
+    a path inside an archive), or None for files directly in root.
+    """
+    prefix = root + "!"
+    if path.startswith(prefix):
+        relpath = path[len(prefix):]
+    else:
+        relpath = os.path.relpath(path, root)
+    parts = relpath.replace("\\", "/").split("/")
+    return parts[0] if len(parts) > 1 else None
+
+
+def _iter_run(f):
+    # Yields the (run time, row) pairs of a spilled run
+    f.seek(0)
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+
+class Timeline(object):
+    """Executions from many files, read back in chronological order.
+
+    add() takes records made by records.timeline_record. Iterating over
+    the timeline yields one row per execution, oldest first: the execution
+    record (see records.execution_records) with a host key added. Ties
+    keep the order in which files were added. Temporary files are created
+    in tempdir, or the default temporary directory, and removed by close().
+    """
+
+    def __init__(self, max_rows=DEFAULT_MAX_ROWS, tempdir=None):
+        if max_rows < 1:
+            raise ValueError("max_rows must be at least 1")
+        self.max_rows = max_rows
+        self.tempdir = tempdir
+        self.rows = []
+        self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.rows) + sum(count for _, count in self.runs)
+
+    def add(self, record, host=None):
+        """Add every execution in a per-file timeline record."""
+        executions = []
+        for runTime, execution in zip(record["run_times"], execution_records(record)):
+            execution["host"] = host
+            executions.append((runTime, execution))
+        executions.sort(key=byRunTime)
+        self.rows.extend(executions)
+        if len(self.rows) >= self.max_rows:
+            self.spill()
+
+    def spill(self):
+        # Writes the executions held in memory to a temporary file as one
+        # sorted run. The rows are a series of sorted runs already, which
+        # the sort merges rather than sorting from scratch
+        if not self.rows:
+            return
+        self.rows.sort(key=byRunTime)
+        f = tempfile.TemporaryFile(dir=self.tempdir)
+        # Each row is pickled on its own: one Pickler and Unpickler per run
+        # would memoise, and so keep alive, every row in it
+        for row in self.rows:
+            pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+        self.runs.append((f, len(self.rows)))
+        self.rows = []
+
+    def __iter__(self):
+        self.rows.sort(key=byRunTime)
+        runs = [_iter_run(f) for f, _ in self.runs]
+        for _, row in heapq.merge(*runs, self.rows, key=byRunTime):
+            yield row
+
+    def close(self):
+        for f, _ in self.runs:
+            f.close()
+        self.runs = []
+        self.rows = []
@@ -1,9 +1,9 @@
-# The code in the class below was taken and then modified from Francesco 
-# Picasso's w10pfdecomp.py script. This modification makes two simple changes:
-#
-#    - Wraps Francesco's logic in a Python class 
-#    - Returns a bytearray of uncompressed data instead of writing it to a new 
-#      file, like Francesco's original code did
+# The code in the class below was originally taken and then modified from
+# Francesco Picasso's w10pfdecomp.py script, which wrapped ntdll's
+# RtlDecompressBufferEx. The MAM header and CRC handling still follow his
+# logic; the ntdll call has been replaced by a pure-Python, table-driven
+# LZXPRESS Huffman decoder (as specified in [MS-XCA] section 2.2) so Windows
+# 10 prefetch files can be parsed in memory on any platform.
 #
 # Author's name: Francesco "dfirfpi" Picasso
 # Author's email: francesco.picasso@gmail.com
@@ -11,13 +11,169 @@
 # License: http://www.apache.org/licenses/LICENSE-2.0
 
 
-import sys
-import ctypes
 import struct
 import binascii
 
 
-# Windows-only utility to decompress MAM compressed files
+# MAM signature, with the algorithm and CRC nibbles masked out
+MAM_MAGIC = 0x004d414d
+
+# COMPRESSION_FORMAT_XPRESS_HUFF, the only algorithm used by prefetch files
+XPRESS_HUFF = 4
+
+# Each Huffman block decodes to at most 64 KiB of output
+CHUNK_SIZE = 65536
+
+# Longest match, and so the furthest decoding can run past a limit
+MAX_MATCH = 65538
+
+# Every chunk starts with its 256-byte code length table and the first 32
+# bits of its stream, which bounds the size a compressed buffer can
+# decompress to
+CHUNK_OVERHEAD = 260
+
+# Largest decompressed size accepted from a MAM header; real prefetch files
+# are a few MB at most
+MAX_DECOMPRESSED_SIZE = 256 * 1024 * 1024
+
+# Longest code allowed by the format, and so the width of the decode table
+TABLE_BITS = 15
+
+# bytes.translate tables splitting a byte into its two 4-bit code lengths
+LOW_NIBBLES = bytes(byte & 0x0F for byte in range(256))
+HIGH_NIBBLES = bytes(byte >> 4 for byte in range(256))
+
+
+def _buildDecodeTable(lengths):
+    # Build a canonical Huffman decode table from the 512 symbol code lengths.
+    # Each of the 2^15 entries maps the next 15 bits of input to
+    # (symbol << 4) | code length, so decoding a symbol is one lookup.
+    # Codes are assigned in (length, symbol) order, so a stable sort of the
+    # symbols by length lets each code's span of entries be appended in turn
+    table = []
+    for symbol in sorted(range(512), key=lengths.__getitem__):
+        bitLength = lengths[symbol]
+        if bitLength:
+            table += [(symbol << 4) | bitLength] * (1 << (TABLE_BITS - bitLength))
+    if not table:
+        raise ValueError("Invalid Huffman table: no symbols")
+    if len(table) > 1 << TABLE_BITS:
+        raise ValueError("Invalid Huffman table: code space overflow")
+    # An incomplete code leaves the rest of the table unused
+    table += [0] * ((1 << TABLE_BITS) - len(table))
+    return table
+
+
+def decompressXpressHuffman(compressed, size, out=None, limit=None):
+    """Decode an LZXPRESS Huffman stream into a preallocated bytearray.
+
+    compressed is any bytes-like object and size is the uncompressed size
+    recorded in the MAM header. The output is written straight into out (a
+    bytearray is allocated when none is given), which is returned. When
+    limit is given decoding stops as soon as at least limit bytes have been
+    produced, and out is truncated to those bytes.
+    """
+    if out is None:
+        # A match can run at most MAX_MATCH bytes past the limit
+        out = bytearray(size if limit is None else min(size, limit + MAX_MATCH))
+    stop = size if limit is None else min(size, limit)
+    # Pad the input so reading past the final 16-bit word yields zero bits
+    # instead of an IndexError. A stream which runs further than that is
+    # truncated, which the checks before each read of the input report.
+    src = bytes(compressed) + b"\x00" * 4
+    srcEnd = len(src) - 4
+
+    inPos = 0
+    outPos = 0
+    while outPos < stop:
+        if inPos + 256 > srcEnd:
+            raise ValueError("Truncated LZXPRESS Huffman stream")
+
+        # Each byte holds the code lengths of two symbols, low nibble first
+        block = src[inPos:inPos + 256]
+        lengths = [0] * 512
+        lengths[0::2] = block.translate(LOW_NIBBLES)
+        lengths[1::2] = block.translate(HIGH_NIBBLES)
+        table = _buildDecodeTable(lengths)
+        inPos += 256
+
+        bits = ((src[inPos] | (src[inPos + 1] << 8)) << 16) | src[inPos + 2] | (src[inPos + 3] << 8)
+        inPos += 4
+        bitCount = 16
+
+        # Stopping early only shortens the last chunk decoded, so the inner
+        # loop needs no extra test
+        chunkEnd = min(outPos + CHUNK_SIZE, stop)
+        while outPos < chunkEnd:
+            entry = table[bits >> 17]
+            length = entry & 0x0F
+            symbol = entry >> 4
+            bits = (bits << length) & 0xFFFFFFFF
+            bitCount -= length
+            if bitCount < 0:
+                if inPos > srcEnd:
+                    raise ValueError("Truncated LZXPRESS Huffman stream")
+                bits |= (src[inPos] | (src[inPos + 1] << 8)) << -bitCount
+                inPos += 2
+                bitCount += 16
+
+            if symbol < 256:
+                out[outPos] = symbol
+                outPos += 1
+                continue
+
+            symbol -= 256
+            matchLength = symbol & 0x0F
+            offsetBits = symbol >> 4
+            if matchLength == 15:
+                # Longer matches store their length in the next bytes
+                if inPos >= srcEnd:
+                    raise ValueError("Truncated LZXPRESS Huffman stream")
+                matchLength = src[inPos]
+                inPos += 1
+                if matchLength == 255:
+                    if inPos + 2 > srcEnd:
+                        raise ValueError("Truncated LZXPRESS Huffman stream")
+                    matchLength = src[inPos] | (src[inPos + 1] << 8)
+                    inPos += 2
+                    if matchLength < 15:
+                        raise ValueError("Invalid LZXPRESS Huffman match length")
+                    matchLength -= 15
+                matchLength += 15
+            matchLength += 3
+
+            if offsetBits:
+                matchOffset = (bits >> (32 - offsetBits)) | (1 << offsetBits)
+                bits = (bits << offsetBits) & 0xFFFFFFFF
+                bitCount -= offsetBits
+                if bitCount < 0:
+                    if inPos > srcEnd:
+                        raise ValueError("Truncated LZXPRESS Huffman stream")
+                    bits |= (src[inPos] | (src[inPos + 1] << 8)) << -bitCount
+                    inPos += 2
+                    bitCount += 16
+            else:
+                matchOffset = 1
+
+            start = outPos - matchOffset
+            end = outPos + matchLength
+            if start < 0 or end > size:
+                raise ValueError("Invalid LZXPRESS Huffman match at output offset {}".format(outPos))
+            if matchOffset >= matchLength:
+                out[outPos:end] = out[start:start + matchLength]
+            else:
+                # Overlapping copy: repeat the last matchOffset bytes
+                pattern = out[start:outPos]
+                out[outPos:end] = (pattern * (matchLength // matchOffset + 1))[:matchLength]
+            outPos = end
+
+        if inPos > srcEnd:
+            raise ValueError("Truncated LZXPRESS Huffman stream")
+    if outPos < size and limit is not None:
+        del out[outPos:]
+    return out
+
+
 class DecompressWin10(object):
     def __init__(self):
         pass
@@ -27,72 +183,41 @@ class DecompressWin10(object):
         return hex((val + (1 << nbits)) % (1 << nbits))
 
     def decompress(self, infile):
-        """Utility core."""
-
-        NULL = ctypes.POINTER(ctypes.c_uint)()
-        SIZE_T = ctypes.c_uint
-        DWORD = ctypes.c_uint32
-        USHORT = ctypes.c_uint16
-        UCHAR  = ctypes.c_ubyte
-        ULONG = ctypes.c_uint32
-        # You must have at least Windows 8, or it should fail.
-        try:
-            RtlDecompressBufferEx = ctypes.windll.ntdll.RtlDecompressBufferEx
-        except AttributeError as e:
-            sys.exit("[ - ] {}".format(e) + \
-            "\n[ - ] Windows 8+ required for this script to decompress Win10 Prefetch files")
-        RtlGetCompressionWorkSpaceSize = \
-            ctypes.windll.ntdll.RtlGetCompressionWorkSpaceSize
-        with open(infile, 'rb') as fin:
-            header = fin.read(8)
-            compressed = fin.read()
-            signature, decompressed_size = struct.unpack('<LL', header)
-            calgo = (signature & 0x0F000000) >> 24
-            crcck = (signature & 0xF0000000) >> 28
-            magic = signature & 0x00FFFFFF
-            if magic != 0x004d414d :
-                sys.exit('Wrong signature... wrong file?')
-
-            if crcck:
-                # I could have used RtlComputeCrc32.
-                file_crc = struct.unpack('<L', compressed[:4])[0]
-                crc = binascii.crc32(header)
-                crc = binascii.crc32(struct.pack('<L',0), crc)
-                compressed = compressed[4:]
-                crc = binascii.crc32(compressed, crc)          
-                if crc != file_crc:
-                    sys.exit('{} Wrong file CRC {0:x} - {1:x}!'.format(infile, crc, file_crc))
-
-            compressed_size = len(compressed)
-
-            ntCompressBufferWorkSpaceSize = ULONG()
-            ntCompressFragmentWorkSpaceSize = ULONG()
-
-            ntstatus = RtlGetCompressionWorkSpaceSize(USHORT(calgo),
-                ctypes.byref(ntCompressBufferWorkSpaceSize),
-                ctypes.byref(ntCompressFragmentWorkSpaceSize))
-
-            if ntstatus:
-                sys.exit('Cannot get workspace size, err: {}'.format(
-                    self.tohex(ntstatus, 32)))
-                    
-            ntCompressed = (UCHAR * compressed_size).from_buffer_copy(compressed)
-            ntDecompressed = (UCHAR * decompressed_size)()
-            ntFinalUncompressedSize = ULONG()
-            ntWorkspace = (UCHAR * ntCompressFragmentWorkSpaceSize.value)()
-            ntstatus = RtlDecompressBufferEx(
-                USHORT(calgo),
-                ctypes.byref(ntDecompressed),
-                ULONG(decompressed_size),
-                ctypes.byref(ntCompressed),
-                ULONG(compressed_size),
-                ctypes.byref(ntFinalUncompressedSize),
-                ctypes.byref(ntWorkspace))
-
-            if ntstatus:
-                sys.exit('Decompression failed, err: {}'.format(
-                    tohex(ntstatus, 32)))
-
-            if ntFinalUncompressedSize.value != decompressed_size:
-                sys.exit('Decompressed with a different size than original!')
-        return bytearray(ntDecompressed)
\ No newline at end of file
+        """Decompress the MAM file at the given path."""
+        with open(infile, "rb") as fin:
+            return self.decompressBuffer(fin.read(), infile)
+
+    def decompressBuffer(self, data, name="<buffer>", limit=None):
+        """Decompress an in-memory MAM file and return a bytearray.
+
+        With limit, only (at least) the first limit bytes are decompressed.
+        """
+        header = bytes(data[:8])
+        if len(header) < 8:
+            raise ValueError("{}: Truncated MAM header".format(name))
+        signature, decompressed_size = struct.unpack("<LL", header)
+        calgo = (signature & 0x0F000000) >> 24
+        crcck = (signature & 0xF0000000) >> 28
+        magic = signature & 0x00FFFFFF
+        if magic != MAM_MAGIC:
+            raise ValueError("{}: Wrong signature... wrong file?".format(name))
+        if calgo != XPRESS_HUFF:
+            raise ValueError("{}: Unsupported compression algorithm {}".format(name, calgo))
+
+        compressed = memoryview(data)[8:]
+        # The size is checked before anything is allocated for it, so a
+        # corrupt or hostile header cannot exhaust memory
+        chunks = -(-decompressed_size // CHUNK_SIZE)
+        if decompressed_size > MAX_DECOMPRESSED_SIZE or chunks * CHUNK_OVERHEAD > len(compressed):
+            raise ValueError("{}: Implausible decompressed size {} for {} compressed bytes".format(
+                name, decompressed_size, len(compressed)))
+        if crcck:
+            file_crc = struct.unpack_from("<L", compressed)[0]
+            crc = binascii.crc32(header)
+            crc = binascii.crc32(struct.pack("<L", 0), crc)
+            compressed = compressed[4:]
+            crc = binascii.crc32(compressed, crc)
+            if crc != file_crc:
+                raise ValueError("{} Wrong file CRC {:x} - {:x}!".format(name, crc, file_crc))
+
+        return decompressXpressHuffman(compressed, decompressed_size, limit=limit)
@@ -0,0 +1,126 @@
+# Continuous monitoring of a prefetch directory. Each poll is a stat-only
+# scan with os.scandir; only files which are new or whose size or mtime
+# changed since the previous poll are opened and parsed, and their run
+# times are compared with the last ones seen so that only executions which
+# happened since then are reported.
+
+
+import time
+from functools import partial
+from collections import namedtuple
+
+from windowsprefetch.windowsprefetch import LazyPrefetch
+from windowsprefetch.discovery import iter_prefetch_files, classify_file
+from windowsprefetch.records import prefetch_record, execution_records
+
+
+# Seconds between polls
+DEFAULT_INTERVAL = 10.0
+
+# What is remembered about each file between polls: its (size, mtime) and
+# the newest run time seen in it (None for files which are not prefetch
+# files)
+WatchState = namedtuple("WatchState", "stamp latest")
+
+
+class PrefetchWatcher(object):
+    """Reports the executions recorded in a directory since the last poll.
+
+    The first poll() only records the current state of every file and
+    returns nothing. Each later poll() returns one execution record (see
+    records.execution_records) for every run time newer than those seen
+    before, oldest first; all the run times of a file which appeared since
+    the previous poll are new. include, exclude and max_depth are as for
+    discovery.iter_prefetch_files. on_skip is called with (path, reason)
+    for files which are not prefetch files and on_error with (path,
+    exception) for files which fail to parse, once per change to the file.
+    Files are parsed with LazyPrefetch in quick mode, which reads only
+    their summary, unless another parser is given.
+    """
+
+    def __init__(self, root, include=None, exclude=None, max_depth=None,
+                 time_format="default", parser=partial(LazyPrefetch, quick=True), on_skip=None,
+                 on_error=None):
+        self.root = root
+        self.include = include
+        self.exclude = exclude
+        self.max_depth = max_depth
+        self.time_format = time_format
+        self.parser = parser
+        self.on_skip = on_skip
+        self.on_error = on_error
+        self.files = {}
+        self.polls = 0
+
+    def poll(self):
+        """Scan the directory once and return the new execution records."""
+        baseline = self.polls == 0
+        self.polls += 1
+        files = {}
+        events = []
+        for candidate in iter_prefetch_files(self.root, self.include, self.exclude,
+                                             self.max_depth, on_skip=self.on_skip,
+                                             classify=False):
+            stamp = (candidate.size, candidate.mtime)
+            state = self.files.get(candidate.path)
+            if state is None or state.stamp != stamp:
+                state = self.update(candidate.path, stamp, state, None if baseline else events)
+            if state is not None:
+                files[candidate.path] = state
+        # Deleted files are forgotten, so a file recreated under the same
+        # name is treated as new
+        self.files = files
+        events.sort(key=lambda event: event[0])
+        return [execution for _, execution in events]
+
+    def update(self, path, stamp, state, events):
+        # Parses a new or changed file and returns its new state, adding
+        # (run time, execution record) to events for each new run time.
+        # Returns None to look at the file again on the next poll
+        try:
+            kind = classify_file(path)
+        except OSError as e:
+            if self.on_skip is not None:
+                self.on_skip(path, str(e))
+            return None
+        if kind is None:
+            if self.on_skip is not None and (state is None or state.latest is not None):
+                self.on_skip(path, "not a prefetch file")
+            return WatchState(stamp, None)
+
+        try:
+            p = self.parser(path)
+            record = prefetch_record(p, self.time_format)
+        except Exception as e:
+            if self.on_error is not None:
+                self.on_error(path, e)
+            # Keep what was seen before, so the runs are still reported
+            # once the file parses again
+            if state is None:
+                return WatchState(stamp, 0)
+            return state._replace(stamp=stamp)
+
+        latest = 0 if state is None or state.latest is None else state.latest
+        # Every change to the file is looked at, whatever its run count: a
+        # file deleted and recreated, or replaced, between polls can have
+        # the count it had before and still hold new runs. A file which was
+        # only rewritten has no run times newer than those seen
+        if events is not None:
+            for runTime, execution in zip(p.runTimes, execution_records(record)):
+                if runTime > latest:
+                    events.append((runTime, execution))
+        return WatchState(stamp, max([latest] + p.runTimes))
+
+
+def watch(root, interval=DEFAULT_INTERVAL, **options):
+    """Poll root every interval seconds, yielding new execution records.
+
+    options are passed to PrefetchWatcher. The generator runs until it is
+    closed or interrupted.
+    """
+    watcher = PrefetchWatcher(root, **options)
+    while True:
+        started = time.monotonic()
+        for execution in watcher.poll():
+            yield execution
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
@@ -15,312 +15,231 @@
 # Contact: <accidentalassist@gmail.com>
 
 
-import os
+import mmap
 import ntpath
 import struct
-import tempfile
-from datetime import datetime,timedelta
+from array import array
 from windowsprefetch.utils import DecompressWin10
-
-
-class Prefetch(object):
-    def __init__(self, infile):
-        self.pFileName = infile
-
-        with open(infile, "rb") as f:
-            if f.read(3).decode("ASCII") == "MAM":
-                f.close()
-                d = DecompressWin10()
-                decompressed = d.decompress(infile)
-                t = tempfile.mkstemp()
-                with open(t[1], "wb+") as f:
-                    f.write(decompressed)
-                    f.seek(0)
-
-                    self.parseHeader(f)
-                    self.fileInformation26(f)
-                    self.metricsArray23(f)
-                    self.traceChainsArray30(f)
-                    self.volumeInformation30(f)
-                    self.getTimeStamps(self.lastRunTime)
-                    self.directoryStrings(f)
-                    self.getFilenameStrings(f)
-                    return
-
-        with open(infile, "rb") as f:
-            self.parseHeader(f)
-            
-            if self.version == 17:
-                self.fileInformation17(f)
-                self.metricsArray17(f)
-                self.traceChainsArray17(f)
-                self.volumeInformation17(f)
-                self.getTimeStamps(self.lastRunTime)
-                self.directoryStrings(f)
-            
-            elif self.version == 23:
-                self.fileInformation23(f)
-                self.metricsArray23(f)
-                self.traceChainsArray17(f)
-                self.volumeInformation23(f)
-                self.getTimeStamps(self.lastRunTime)
-                self.directoryStrings(f)
-
-            elif self.version == 26:
-                self.fileInformation26(f)
-                self.metricsArray23(f)
-                self.traceChainsArray17(f)
-                self.volumeInformation23(f)
-                self.getTimeStamps(self.lastRunTime)
-                self.directoryStrings(f)
-
-            self.getFilenameStrings(f)
-
-    def parseHeader(self, infile):
+from windowsprefetch.filetime import filetime_formatter
+from windowsprefetch.arrays import MetricsArray, TraceChainsArray
+from windowsprefetch.stats import NULL_STATS
+from windowsprefetch.layouts import HEADER, SUMMARY_SIZE, layout_for
+
+
+# Formats FILETIMEs as the default text
+DEFAULT_FORMATTER = filetime_formatter()
+
+
+class PrefetchBase(object):
+    # Section decoders shared by Prefetch and LazyPrefetch. Every method
+    # decodes from an in-memory buffer at absolute offsets
+    __slots__ = ()
+
+    def setOptions(self, name, stats, strings):
+        # Sets the file name and the options shared by every constructor
+        self.pFileName = name
+        self.stats = NULL_STATS if stats is None else stats
+        self.strings = strings
+        self.resourceIds = None
+        self.directoryStringIds = None
+
+    @classmethod
+    def from_fileobj(cls, fileobj, name=None, stats=None, strings=None):
+        # Parses a prefetch file from an open binary file object, which is
+        # read to the end; name defaults to the object's name attribute
+        if name is None:
+            name = getattr(fileobj, "name", "<fileobj>")
+        return cls.from_bytes(fileobj.read(), name, stats, strings)
+
+    def loadBuffer(self, buf, limit=None):
+        # Returns the buffer to parse and whether it was MAM compressed.
+        # limit stops decompression once that many bytes are available
+        if buf[:3] == b"MAM":
+            d = DecompressWin10()
+            with self.stats.phase("decompress"):
+                return memoryview(d.decompressBuffer(buf, self.pFileName, limit)), True
+        return buf, False
+
+    def readFile(self):
+        # Returns the contents of the file being parsed
+        with self.stats.phase("read"):
+            with open(self.pFileName, "rb") as f:
+                data = f.read()
+        self.stats.count("reads")
+        self.stats.count("bytesRead", len(data))
+        return data
+
+    def readSummary(self):
+        # Returns the first SUMMARY_SIZE bytes of the file being parsed, or
+        # all of it when compressed, as the decoder needs the whole stream
+        with self.stats.phase("read"):
+            with open(self.pFileName, "rb") as f:
+                data = f.read(SUMMARY_SIZE)
+                if data[:3] == b"MAM":
+                    data += f.read()
+        self.stats.count("reads")
+        self.stats.count("bytesRead", len(data))
+        return data
+
+    def parseSummary(self, buf):
+        # Decodes the header, the file information block and the first
+        # metrics entry, which hold everything but the string tables. Once
+        # decompressed, a MAM file is laid out like any other of its version
+        with self.stats.phase("header"):
+            self.parseHeader(buf)
+            layout = layout_for(self.version)
+            self.fileInformation(buf, layout)
+            self.firstMetricsEntry(buf, layout)
+
+        self.getTimeStamps(self.lastRunTime)
+
+    def parseMetrics(self, buf):
+        # Decodes every file metrics entry into a columnar MetricsArray
+        with self.stats.phase("metrics"):
+            self.metrics = MetricsArray(buf, self.metricsOffset, self.metricsCount, self.version)
+
+    def parseTraceChains(self, buf):
+        # Keeps the raw trace chains array for on-demand decoding
+        with self.stats.phase("traceChains"):
+            self.traceChainsArray(buf, layout_for(self.version))
+
+    def parseVolumes(self, buf):
+        # Decodes the volume information array and its directory strings
+        with self.stats.phase("volumes"):
+            self.volumeInformation(buf, layout_for(self.version))
+
+    def parseHeader(self, buf):
         # Parse the file header
         # 84 bytes
-        self.version = struct.unpack_from("I", infile.read(4))[0]
-        self.signature = struct.unpack_from("I", infile.read(4))[0]
-        unknown0 = struct.unpack_from("I", infile.read(4))[0]
-        self.fileSize = struct.unpack_from("I", infile.read(4))[0]
-        self.executableName = struct.unpack_from("60s", infile.read(60))[0].decode("UTF-16", errors="backslashreplace").split("\x00")[0]
-        rawhash = hex(struct.unpack_from("I", infile.read(4))[0])
-        self.hash = rawhash.lstrip("0x")
-        unknown1 = infile.read(4)
-
-    def fileInformation17(self, infile):
-        # File Information
-        # 68 bytes
-        self.metricsOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.metricsCount = struct.unpack_from("I", infile.read(4))[0]
-        self.traceChainsOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.traceChainsCount = struct.unpack_from("I", infile.read(4))[0]
-        self.filenameStringsOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.filenameStringsSize = struct.unpack_from("I", infile.read(4))[0]
-        self.volumesInformationOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.volumesCount = struct.unpack_from("I", infile.read(4))[0]
-        self.volumesInformationSize = struct.unpack_from("I", infile.read(4))[0]
-        self.lastRunTime = infile.read(8)
-        unknown0 = infile.read(16)
-        self.runCount = struct.unpack_from("I", infile.read(4))[0]
-        unknown1 = infile.read(4)
-
-    def metricsArray17(self, infile):
-        # File Metrics Array
-        # 20 bytes
-        unknown0 = infile.read(4)
-        unknown1 = infile.read(4)
-        self.filenameOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.filenameLength = struct.unpack_from("I", infile.read(4))[0]
-        unknown2 = infile.read(4)
-
-    def traceChainsArray17(self, infile):
-        # Read through the Trace Chains Array
-        # Not being parsed for information
-        # Broken out as its own function for possible future use
-        # 12 bytes
-        infile.read(12)
-
-    def volumeInformation17(self, infile):
-        # Volume information
-        # 40 bytes per entry in the array
-        
-        infile.seek(self.volumesInformationOffset)
-        self.volumesInformationArray = []
-        self.directoryStringsArray = []
-
-        count = 0
-        while count < self.volumesCount:
-            self.volPathOffset = struct.unpack_from("I", infile.read(4))[0]
-            self.volPathLength = struct.unpack_from("I", infile.read(4))[0]
-            self.volCreationTime = struct.unpack_from("Q", infile.read(8))[0]
-            self.volSerialNumber = hex(struct.unpack_from("I", infile.read(4))[0])
-            self.volSerialNumber = self.volSerialNumber.rstrip("L").lstrip("0x")
-            self.fileRefOffset = struct.unpack_from("I", infile.read(4))[0]
-            self.fileRefSize = struct.unpack_from("I", infile.read(4))[0]
-            self.dirStringsOffset = struct.unpack_from("I", infile.read(4))[0]
-            self.dirStringsCount = struct.unpack_from("I", infile.read(4))[0]
-            unknown0 = infile.read(4)
-
-            self.directoryStringsArray.append(self.directoryStrings(infile))
-
-            infile.seek(self.volumesInformationOffset + self.volPathOffset)
-            volume = {}
-            volume["Volume Name"] = infile.read(self.volPathLength * 2)
-            volume["Creation Date"] = self.convertTimestamp(self.volCreationTime)
-            volume["Serial Number"] = self.volSerialNumber
-            self.volumesInformationArray.append(volume)
-            
-            count += 1
-            infile.seek(self.volumesInformationOffset + (40 * count))
-
-    def fileInformation23(self, infile):
-        # File Information
-        # 156 bytes
-        self.metricsOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.metricsCount = struct.unpack_from("I", infile.read(4))[0]
-        self.traceChainsOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.traceChainsCount = struct.unpack_from("I", infile.read(4))[0]
-        self.filenameStringsOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.filenameStringsSize = struct.unpack_from("I", infile.read(4))[0]
-        self.volumesInformationOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.volumesCount = struct.unpack_from("I", infile.read(4))[0]
-        self.volumesInformationSize = struct.unpack_from("I", infile.read(4))[0]
-        unknown0 = infile.read(8)
-        self.lastRunTime = infile.read(8)
-        unknown1 = infile.read(16)
-        self.runCount = struct.unpack_from("I", infile.read(4))[0]
-        unknown2 = infile.read(84)
-
-    def metricsArray23(self, infile):
-        # File Metrics Array
-        # 32 bytes per array, not parsed in this script
-        infile.seek(self.metricsOffset)
-        unknown0 = infile.read(4)
-        unknown1 = infile.read(4)
-        unknown2 = infile.read(4)
-        self.filenameOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.filenameLength = struct.unpack_from("I", infile.read(4))[0]
-        unknown3 = infile.read(4)
-        self.mftSeqNumber, self.mftEntryNumber = self.convertFileReference(infile.read(8))
-        #self.mftSeqNumber = struct.unpack_from("H", infile.read(2))[0]
-
-    def volumeInformation23(self, infile):
-        # This function consumes the Volume Information array
-        # 104 bytes per structure in the array
-        # Returns a dictionary object which holds another dictionary
-        # for each volume information array entry
-
-        infile.seek(self.volumesInformationOffset)
-        self.volumesInformationArray = []
-        self.directoryStringsArray = []
-        
-        count = 0
-        while count < self.volumesCount:
-            self.volPathOffset = struct.unpack_from("I", infile.read(4))[0]
-            self.volPathLength = struct.unpack_from("I", infile.read(4))[0]
-            self.volCreationTime = struct.unpack_from("Q", infile.read(8))[0]
-            volSerialNumber = hex(struct.unpack_from("I", infile.read(4))[0])
-            self.volSerialNumber = volSerialNumber.rstrip("L").lstrip("0x")
-            self.fileRefOffset = struct.unpack_from("I", infile.read(4))[0]
-            self.fileRefCount = struct.unpack_from("I", infile.read(4))[0]
-            self.dirStringsOffset = struct.unpack_from("I", infile.read(4))[0]
-            self.dirStringsCount = struct.unpack_from("I", infile.read(4))[0]
-            unknown0 = infile.read(68)
-
-            self.directoryStringsArray.append(self.directoryStrings(infile))
-            
-            infile.seek(self.volumesInformationOffset + self.volPathOffset)
-            volume = {}
-            volume["Volume Name"] = infile.read(self.volPathLength * 2)
-            volume["Creation Date"] = self.convertTimestamp(self.volCreationTime)
-            volume["Serial Number"] = self.volSerialNumber
-            self.volumesInformationArray.append(volume)
-            
-            count += 1
-            infile.seek(self.volumesInformationOffset + (104 * count))
-
-
-    def fileInformation26(self, infile):
-        # File Information
-        # 224 bytes
-        self.metricsOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.metricsCount = struct.unpack_from("I", infile.read(4))[0]
-        self.traceChainsOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.traceChainsCount = struct.unpack_from("I", infile.read(4))[0]
-        self.filenameStringsOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.filenameStringsSize = struct.unpack_from("I", infile.read(4))[0]
-        self.volumesInformationOffset = struct.unpack_from("I", infile.read(4))[0]
-        self.volumesCount = struct.unpack_from("I", infile.read(4))[0]
-        self.volumesInformationSize = struct.unpack_from("I", infile.read(4))[0]
-        unknown0 = infile.read(8)
-        self.lastRunTime = infile.read(64)
-        unknown1 = infile.read(16)
-        self.runCount = struct.unpack_from("I", infile.read(4))[0]
-        unknown2 = infile.read(96)
-
-    def traceChainsArray30(self, infile):
+        (self.version, self.signature, self.fileSize, executableName,
+         pfhash) = HEADER.unpack_from(buf, 0)
+        self.executableName = str(executableName, "UTF-16", "backslashreplace").split("\x00")[0]
+        self.hash = hex(pfhash).lstrip("0x")
+
+    def fileInformation(self, buf, layout):
+        # File Information, following the header: the section offsets and
+        # counts, the last run times and the run count
+        (self.metricsOffset, self.metricsCount,
+         self.traceChainsOffset, self.traceChainsCount,
+         self.filenameStringsOffset, self.filenameStringsSize,
+         self.volumesInformationOffset, self.volumesCount,
+         self.volumesInformationSize, self.lastRunTime,
+         self.runCount) = layout.fileInformation.unpack_from(buf, HEADER.size)
+
+    def firstMetricsEntry(self, buf, layout):
+        # The first entry of the File Metrics Array, which describes the
+        # executable; the whole array is decoded by parseMetrics. Format
+        # version 17 does not record the NTFS file reference
+        entry = dict(zip(layout.metrics.names, layout.metrics.unpack_from(buf, self.metricsOffset)))
+        self.filenameOffset = entry["filenameOffset"]
+        self.filenameLength = entry["filenameLength"]
+        if "fileReference" in entry:
+            self.mftSeqNumber, self.mftEntryNumber = splitFileReference(entry["fileReference"])
+
+    def traceChainsArray(self, buf, layout):
         # Trace Chains Array
-        # Read though, not being parsed for information
-        # Broken out as its own function for possible future use
-        # 8 bytes
-        infile.read(8)
-
-    def volumeInformation30(self, infile):
-        # Volumes Information
-        # 96 bytes
+        # decoded by TraceChainsArray when first used
+        start = self.traceChainsOffset
+        end = start + layout.traceChain.size * self.traceChainsCount
+        self.traceChains = TraceChainsArray(bytes(buf[start:end]), self.version)
 
-        infile.seek(self.volumesInformationOffset)
+    def volumeInformation(self, buf, layout):
+        # Volume information
+        # the fixed-size entries are decoded in one pass over the array
         self.volumesInformationArray = []
         self.directoryStringsArray = []
+        if self.strings is not None:
+            self.directoryStringIds = []
+
+        base = self.volumesInformationOffset
+        end = base + layout.volume.size * self.volumesCount
+        if end > len(buf):
+            raise ValueError("Volume information array extends past the end of the file")
+
+        for (volPathOffset, volPathLength, volCreationTime, volSerialNumber,
+             fileRefOffset, fileRefSize, dirStringsOffset,
+             dirStringsCount) in layout.volume.iter_unpack(buf[base:end]):
+
+            if self.strings is None:
+                self.directoryStringsArray.append(
+                    self.directoryStrings(buf, base + dirStringsOffset, dirStringsCount))
+            else:
+                ids = self.internDirectoryStrings(buf, base + dirStringsOffset, dirStringsCount)
+                self.directoryStringIds.append(ids)
+                self.directoryStringsArray.append(self.strings.lookup(ids))
 
-        count = 0
-        while count < self.volumesCount:
-            self.volPathOffset = struct.unpack_from("I", infile.read(4))[0] 
-            self.volPathLength = struct.unpack_from("I", infile.read(4))[0]
-            self.volCreationTime = struct.unpack_from("Q", infile.read(8))[0]
-            self.volSerialNumber = hex(struct.unpack_from("I", infile.read(4))[0])
-            self.volSerialNumber = self.volSerialNumber.rstrip("L").lstrip("0x")
-            self.fileRefOffset = struct.unpack_from("I", infile.read(4))[0]
-            self.fileRefCount = struct.unpack_from("I", infile.read(4))[0]
-            self.dirStringsOffset = struct.unpack_from("I", infile.read(4))[0]
-            self.dirStringsCount = struct.unpack_from("I", infile.read(4))[0]
-            unknown0 = infile.read(60)
-
-            self.directoryStringsArray.append(self.directoryStrings(infile))
-
-            infile.seek(self.volumesInformationOffset + self.volPathOffset)
             volume = {}
-            volume["Volume Name"] = infile.read(self.volPathLength * 2)
-            volume["Creation Date"] = self.convertTimestamp(self.volCreationTime)
-            volume["Serial Number"] = self.volSerialNumber
+            volume["Volume Name"] = bytes(buf[base + volPathOffset:base + volPathOffset + volPathLength * 2])
+            # Kept raw, like the run times, and only formatted for output
+            volume["Creation Time"] = volCreationTime
+            volume["Serial Number"] = hex(volSerialNumber).rstrip("L").lstrip("0x")
             self.volumesInformationArray.append(volume)
-            
-            count += 1
-            infile.seek(self.volumesInformationOffset + (96 * count))
 
-
-
-    def getFilenameStrings(self, infile):
-        # Parses filename strings from the PF file
-        infile.seek(self.filenameStringsOffset)
-        self.filenames = infile.read(self.filenameStringsSize)
-        self.resources = self.filenames.decode("UTF-16", errors="backslashreplace").split("\x00")[:-1]
+    def getFilenameStrings(self, buf):
+        # Parses filename strings from the PF file. The raw UTF-16 section is
+        # kept as filenames, unless a StringTable holds the strings, in which
+        # case filenames is None
+        start = self.filenameStringsOffset
+        with self.stats.phase("filenames"):
+            filenames = buf[start:start + self.filenameStringsSize]
+            self.resources = str(filenames, "UTF-16", "backslashreplace").split("\x00")[:-1]
+            if self.strings is None:
+                self.filenames = bytes(filenames)
+            else:
+                self.filenames = None
+                self.resourceIds = self.strings.intern_all(self.resources)
+                self.resources = self.strings.lookup(self.resourceIds)
 
 
     def convertTimestamp(self, timestamp):
         # Timestamp is a Win32 FILETIME value
         # This function returns that value in a human-readable format
-        return str(datetime(1601,1,1) + timedelta(microseconds=timestamp / 10.))
+        return convertTimestamp(timestamp)
 
 
     def getTimeStamps(self, lastRunTime):
-        self.timestamps = []
+        with self.stats.phase("timestamps"):
+            self.decodeTimeStamps(lastRunTime)
 
-        for timestamp in range(8):
-            try:
-                start_ts = timestamp * 8
-                ts = struct.unpack_from("Q", lastRunTime[start_ts:start_ts + 8])[0]
-                if ts:
-                    self.timestamps.append(convertTimestamp(ts))
-            except struct.error:
-                return self.timestamps
+    def decodeTimeStamps(self, lastRunTime):
+        # Keeps the last run times as raw FILETIMEs, skipping unused slots;
+        # they are only formatted when timestamps is read
+        count = len(lastRunTime) // 8
+        self.runTimes = [ts for ts in struct.unpack_from("<{}Q".format(count), lastRunTime) if ts]
 
+    @property
+    def timestamps(self):
+        # The last run times in the default text format
+        return list(map(DEFAULT_FORMATTER, self.runTimes))
 
-    def directoryStrings(self, infile):
-        infile.seek(self.volumesInformationOffset)
-        infile.seek(self.dirStringsOffset, 1)
 
+    def directoryStrings(self, buf, offset, count):
+        # Decodes count length-prefixed UTF-16 strings starting at offset
         directoryStrings = []
 
-        count = 0
-        while count < self.dirStringsCount:
-            # Below we account for the NULL byte, which is not included in stringLength
-            stringLength = struct.unpack_from("<H", infile.read(2))[0] * 2 + 2
-            directoryStrings.append((infile.read(stringLength).decode("UTF-16", errors="backslashreplace")))
-            count += 1
+        with self.stats.phase("directoryStrings"):
+            for _ in range(count):
+                # Below we account for the NULL byte, which is not included in stringLength
+                stringLength = struct.unpack_from("<H", buf, offset)[0] * 2 + 2
+                offset += 2
+                directoryStrings.append(str(buf[offset:offset + stringLength], "UTF-16", "backslashreplace"))
+                offset += stringLength
         return directoryStrings
 
+    def internDirectoryStrings(self, buf, offset, count):
+        # As directoryStrings, but adds the strings to the shared string
+        # table and returns their IDs. Strings already in the table are
+        # found by their raw bytes and not decoded again
+        ids = array("I")
+
+        with self.stats.phase("directoryStrings"):
+            for _ in range(count):
+                stringLength = struct.unpack_from("<H", buf, offset)[0] * 2 + 2
+                offset += 2
+                ids.append(self.strings.intern_utf16(buf[offset:offset + stringLength]))
+                offset += stringLength
+        return ids
+
 
     def convertFileReference(self, buf):
         sequenceNumber = int.from_bytes(buf[-2:], byteorder="little")
@@ -328,41 +247,277 @@ class Prefetch(object):
         return sequenceNumber, entryNumber
 
 
-    def prettyPrint(self):
-        # Prints important Prefetch data in a structured format
+    def traceChainSummary(self):
+        # Yields (resource, trace chain entries, total block loads) for each
+        # loaded resource, decoding the trace chains array if needed
+        if self.traceChains is None:
+            raise ValueError("Trace chains were not kept; parse with keepTraceChains=True")
+        entryCounts, blockLoads = self.traceChains.summary(self.metrics)
+        return zip(self.resources, entryCounts, blockLoads)
+
+    def prettyFormat(self, timeFormat="default"):
+        # Returns important Prefetch data in a structured format, with
+        # times in one of the formats of windowsprefetch.filetime
+        formatTime = filetime_formatter(timeFormat)
+        timestamps = [formatTime(ts) for ts in self.runTimes]
+        lines = []
         banner = "=" * (len(ntpath.basename(self.pFileName)) + 2)
-        print("\n{0}\n{1}\n{0}\n".format(banner, ntpath.basename(self.pFileName)))
-        print("Executable Name: {}\n".format(self.executableName))
-        print("Run count: {}\n".format(self.runCount))
-
-        if len(self.timestamps) > 1:
-            print("Last Executed:")
-            for timestamp in self.timestamps:
-                print("    " + timestamp)
+        lines.append("\n{0}\n{1}\n{0}\n".format(banner, ntpath.basename(self.pFileName)))
+        lines.append("Executable Name: {}\n".format(self.executableName))
+        lines.append("Run count: {}\n".format(self.runCount))
+
+        if len(timestamps) > 1:
+            lines.append("Last Executed:")
+            for timestamp in timestamps:
+                lines.append("    {}".format(timestamp))
         else:
-            print("Last Executed: {}".format(self.timestamps[0]))
-        
-        print("\nVolume Information:")
+            lines.append("Last Executed: {}".format(timestamps[0]))
+
+        lines.append("\nVolume Information:")
         for i in self.volumesInformationArray:
-            print("   Volume Name: " + i["Volume Name"].decode("UTF-16", errors="backslashreplace"))
-            print("   Creation Date: " + i["Creation Date"])
-            print("   Serial Number: " + i["Serial Number"])
-            print()
+            lines.append("   Volume Name: " + i["Volume Name"].decode("UTF-16", errors="backslashreplace"))
+            lines.append("   Creation Date: {}".format(formatTime(i["Creation Time"])))
+            lines.append("   Serial Number: " + i["Serial Number"])
+            lines.append("")
 
-        print("Directory Strings:")
+        lines.append("Directory Strings:")
         for volume in self.directoryStringsArray:
             for dirstring in enumerate(volume):
-                print("{:>4}: {}".format(dirstring[0], dirstring[1]))
-        print()
+                lines.append("{:>4}: {}".format(dirstring[0], dirstring[1]))
+        lines.append("")
 
-        print("Resources Loaded:")
+        lines.append("Resources Loaded:")
         for resource in enumerate(self.resources):
-            print("{:>4}: {}".format(resource[0], resource[1]))
-        print()
-    
+            lines.append("{:>4}: {}".format(resource[0], resource[1]))
+        lines.append("")
+        return "\n".join(lines)
+
+    def prettyPrint(self):
+        # Prints important Prefetch data in a structured format
+        print(self.prettyFormat())
+
+
+class Prefetch(PrefetchBase):
+    def __init__(self, infile, useMmap=False, stats=None, strings=None, keepTraceChains=False):
+        # The file is read once, into a bytes object or a read-only memory
+        # map when useMmap is set, and every section is decoded from that
+        # buffer at absolute offsets. stats, a ParseStats from
+        # windowsprefetch.stats, collects per-phase timings when given.
+        # strings, a StringTable from windowsprefetch.strings, is shared
+        # between files to store each distinct path once; resourceIds and
+        # directoryStringIds then hold the paths' IDs in the table. The raw
+        # trace chains array is only kept, as traceChains, when
+        # keepTraceChains is set; otherwise traceChains is None
+        self.setOptions(infile, stats, strings)
+        self.keepTraceChains = keepTraceChains
+
+        try:
+            if useMmap:
+                with open(infile, "rb") as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                        self.stats.count("bytesMapped", len(m))
+                        self.parse(m)
+            else:
+                self.parse(self.readFile())
+        except Exception:
+            self.stats.count("failures")
+            raise
+
+    @classmethod
+    def from_bytes(cls, data, name="<bytes>", stats=None, strings=None, keepTraceChains=False):
+        # Parses a prefetch file which is already in memory, such as an
+        # archive member; name stands in for the file name in the output
+        self = cls.__new__(cls)
+        self.setOptions(name, stats, strings)
+        self.keepTraceChains = keepTraceChains
+        try:
+            self.parse(data)
+        except Exception:
+            self.stats.count("failures")
+            raise
+        return self
+
+    def parse(self, data):
+        # Parses an in-memory prefetch file; MAM compressed files are
+        # decompressed into a bytearray and parsed from there
+        with memoryview(data) as raw:
+            buf, compressed = self.loadBuffer(raw)
+            self.stats.count("compressed" if compressed else "plain")
+            with buf:
+                self.parseSummary(buf)
+                self.parseMetrics(buf)
+                if self.keepTraceChains:
+                    self.parseTraceChains(buf)
+                else:
+                    self.traceChains = None
+                self.parseVolumes(buf)
+                self.getFilenameStrings(buf)
+
+
+def lazySection(slot, decode):
+    # Property which runs the named decoder the first time the slot is read
+    def fget(self):
+        value = getattr(self, slot)
+        if value is None:
+            getattr(self, decode)()
+            value = getattr(self, slot)
+        return value
+
+    def fset(self, value):
+        setattr(self, slot, value)
+
+    return property(fget, fset)
+
+
+class LazyPrefetch(PrefetchBase):
+    # Memory-lean variant of Prefetch: the header, file information and last
+    # run times are decoded up front, while volumes, directory strings and
+    # resources are decoded on first access and then cached. Unless
+    # keepBuffer is set the file contents are not retained, so the first
+    # access to a lazy section reads (and if need be decompresses) the file
+    # again, and decodes every lazy section from that one read. stats and
+    # strings are as for Prefetch.
+    #
+    # With quick set only the summary is read: the first SUMMARY_SIZE bytes
+    # of an uncompressed file, or as much of a compressed one as is needed
+    # to decompress that many. This is all that is needed for the
+    # executable name, hash, version, run count and run times.
+    __slots__ = (
+        "pFileName", "version", "signature", "fileSize", "executableName",
+        "hash", "metricsOffset", "metricsCount", "traceChainsOffset",
+        "traceChainsCount", "filenameStringsOffset", "filenameStringsSize",
+        "volumesInformationOffset", "volumesCount", "volumesInformationSize",
+        "lastRunTime", "runCount", "runTimes", "filenameOffset",
+        "filenameLength", "mftSeqNumber", "mftEntryNumber", "stats",
+        "strings", "resourceIds", "directoryStringIds",
+        "_compressed", "_buffer", "_volumesInformationArray",
+        "_directoryStringsArray", "_filenames", "_resources", "_metrics",
+        "_traceChains", "_raw",
+    )
+
+    volumesInformationArray = lazySection("_volumesInformationArray", "decodeVolumes")
+    directoryStringsArray = lazySection("_directoryStringsArray", "decodeVolumes")
+    resources = lazySection("_resources", "decodeFilenameStrings")
+    metrics = lazySection("_metrics", "decodeMetrics")
+    traceChains = lazySection("_traceChains", "decodeTraceChains")
+
+    def __init__(self, infile, keepBuffer=False, stats=None, strings=None, quick=False):
+        self.setOptions(infile, stats, strings)
+        self.load(None, keepBuffer, quick)
+
+    @classmethod
+    def from_bytes(cls, data, name="<bytes>", stats=None, strings=None, quick=False):
+        # As Prefetch.from_bytes. The buffer is always kept, since there is
+        # no file to read the lazy sections from again
+        self = cls.__new__(cls)
+        self.setOptions(name, stats, strings)
+        self.load(data, True, quick)
+        return self
+
+    def load(self, data, keepBuffer, quick=False):
+        # Decodes the summary from data, or from the file when data is None
+        self._volumesInformationArray = None
+        self._directoryStringsArray = None
+        self._filenames = None
+        self._resources = None
+        self._metrics = None
+        self._traceChains = None
+        self._raw = None
+
+        try:
+            if quick and self.loadSummary(data):
+                return
+            if data is None:
+                data = self.readFile()
+            buf, self._compressed = self.loadBuffer(memoryview(data))
+            self.stats.count("compressed" if self._compressed else "plain")
+            self.parseSummary(buf)
+        except Exception:
+            self.stats.count("failures")
+            raise
+        self._buffer = buf if keepBuffer else None
+
+    def loadSummary(self, data):
+        # Decodes the summary from the start of the file alone, returning
+        # False when the first metrics entry lies beyond SUMMARY_SIZE. data,
+        # when given, is kept to decode the sections from
+        if data is None:
+            data = self.readSummary()
+            self._raw = None
+        else:
+            self._raw = data
+        buf, self._compressed = self.loadBuffer(memoryview(data), SUMMARY_SIZE)
+        try:
+            self.parseSummary(buf)
+        except struct.error:
+            self._raw = None
+            return False
+        self.stats.count("compressed" if self._compressed else "plain")
+        self._buffer = None
+        return True
+
+    def sectionBuffer(self):
+        # Returns the kept buffer, or None when it was released. After a
+        # quick load from memory the whole buffer is decoded once
+        if self._buffer is None and self._raw is not None:
+            self._buffer = self.loadBuffer(memoryview(self._raw))[0]
+            self._raw = None
+        return self._buffer
+
+    def decodeSection(self, parse):
+        # Decodes one lazy section from the kept buffer. Without one, the
+        # file is read, and decompressed, once for every section not yet
+        # decoded, rather than once per section
+        buf = self.sectionBuffer()
+        if buf is not None:
+            parse(buf)
+            return
+        buf = self.loadBuffer(memoryview(self.readFile()))[0]
+        if self._metrics is None:
+            self.parseMetrics(buf)
+        if self._traceChains is None:
+            self.parseTraceChains(buf)
+        if self._volumesInformationArray is None:
+            self.parseVolumes(buf)
+        if self._resources is None:
+            self.getFilenameStrings(buf)
+
+    def decodeVolumes(self):
+        self.decodeSection(self.parseVolumes)
+
+    def decodeMetrics(self):
+        self.decodeSection(self.parseMetrics)
+
+    def decodeTraceChains(self):
+        self.decodeSection(self.parseTraceChains)
+
+    @property
+    def filenames(self):
+        # Decoded along with resources, and so None when strings is set
+        if self._resources is None:
+            self.decodeFilenameStrings()
+        return self._filenames
+
+    @filenames.setter
+    def filenames(self, value):
+        self._filenames = value
+
+    def decodeFilenameStrings(self):
+        self.decodeSection(self.getFilenameStrings)
+
+    def releaseBuffer(self):
+        # Drops the kept file contents once every needed section is decoded
+        self._buffer = None
+
 
 def convertTimestamp(timestamp):
         # Timestamp is a Win32 FILETIME value
-        # This function returns that value in a human-readable format
-        return str(datetime(1601,1,1) + timedelta(microseconds=timestamp / 10.))
+        # This function returns that value in a human-readable format, or
+        # the raw value when it is outside the range of datetime
+        return DEFAULT_FORMATTER(timestamp)
+
 
+def splitFileReference(reference):
+    # Splits a 64-bit NTFS file reference into its sequence number (the top
+    # 16 bits) and MFT entry number
+    return reference >> 48, reference & 0xFFFFFFFFFFFF